@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import beta, binom
+
+# Exact evaluation of the probability that eavesdropping goes undetected, without simulating.
+# For every transmitted bit Alice's and Bob's bases match with probability 1/2, so the sifted key length S is
+# Binomial(L_init, 1/2). Each sifted bit is wrong independently of the others with probability e:
+#   without eavesdropping   e = p * f
+#   with eavesdropping      e = 1/2 * (p * f) + 1/2 * 1/2
+#                           (Eve picks the right basis and resends the right state, which the channel flips with
+#                           probability p * f, or she picks the wrong one and Bob's outcome is uniformly random)
+# where f is the fraction of the bases whose states are flipped by the channel operator: 1/2 for X (flips Z
+# states) and Z (flips X states), 1 for Y (flips both), 0 without channel errors.
+# Given S = s, simulate_bb84 discloses n = int(s * k) bits and does not detect Eve when the M ~ Binomial(n, e)
+# mismatched bits are at most threshold = detection_threshold(n, ...), so
+#   P(undetected) = sum_s P(S = s) * P(M <= threshold(int(s * k)) | n = int(s * k))
+# The sum only runs over the sifted lengths within SIFTED_TAIL_SIGMAS standard deviations of L_init / 2, the
+# probability of the others is below exp(-SIFTED_TAIL_SIGMAS ** 2 / 2) and underflows to 0 anyway.
+SIFTED_TAIL_SIGMAS = 40
+
+
+def sifted_error_rate(eavesdropping_event, bit_flip_event, phase_flip_event, p):
+    flipped_bases = (0.5 if bit_flip_event else 0.0) + (0.5 if phase_flip_event else 0.0)
+    error = p * flipped_bases
+    if eavesdropping_event:
+        error = 0.5 * error + 0.25
+    return error
+
+
+def vectorized_threshold(n_disclosed_bits, bit_flip_event, phase_flip_event, p):
+    # BB84_PostProcessing.detection_threshold for an array of disclosed lengths, same floating point operations
+    if bit_flip_event and phase_flip_event:
+        return (n_disclosed_bits * p).astype(np.int64)
+    elif bit_flip_event or phase_flip_event:
+        return (n_disclosed_bits * (p / 2)).astype(np.int64)
+    return np.zeros_like(n_disclosed_bits)
+
+
+def probability_undetected_exact(eavesdropping_event, bit_flip_event, phase_flip_event, L_init, p, k):
+    half_width = int(np.ceil(SIFTED_TAIL_SIGMAS * np.sqrt(L_init) / 2))
+    sifted = np.arange(max(0, L_init // 2 - half_width), min(L_init, L_init // 2 + half_width + 1) + 1)
+    sifted_probability = binom.pmf(sifted, L_init, 0.5)
+    n_disclosed_bits = (sifted * k).astype(np.int64)
+    threshold = vectorized_threshold(n_disclosed_bits, bit_flip_event, phase_flip_event, p)
+    error = sifted_error_rate(eavesdropping_event, bit_flip_event, phase_flip_event, p)
+    undetected = binom.cdf(threshold, n_disclosed_bits, error)
+    return float(np.clip(np.sum(sifted_probability * undetected), 0.0, 1.0))
+
+
+def clopper_pearson(successes, n, alpha=0.01):
+    # exact binomial confidence interval for successes out of n
+    lower = beta.ppf(alpha / 2, successes, n - successes + 1) if successes > 0 else 0.0
+    upper = beta.ppf(1 - alpha / 2, successes + 1, n - successes) if successes < n else 1.0
+    return float(lower), float(upper)
+
+
+def probability_undetected_analytic(eavesdropping_event, bit_flip_event, phase_flip_event, L_init, p_pu, k_r,
+                                    repetitions=None, alpha=0.01):
+    # same columns as BB84_Utils.probability_undetected_experiment, undetected_mean is exact so its interval
+    # offsets undetected_lower/upper are 0. With repetitions given, prediction_lower/upper are the bounds (not
+    # offsets) of the interval where the mean of that many simulated repetitions falls with probability at least
+    # 1 - alpha (binomial quantiles)
+    rows = []
+    for k in k_r:
+        probability = probability_undetected_exact(eavesdropping_event, bit_flip_event, phase_flip_event, L_init,
+                                                   p_pu, k)
+        row = {
+            "k": k,
+            "undetected_mean": probability,
+            "undetected_lower": 0.0,
+            "undetected_upper": 0.0
+        }
+        if repetitions:
+            row["prediction_lower"] = binom.ppf(alpha / 2, repetitions, probability) / repetitions
+            row["prediction_upper"] = binom.ppf(1 - alpha / 2, repetitions, probability) / repetitions
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def cross_validate_undetected(df_cells, eavesdropping_event, bit_flip_event, phase_flip_event, L_init, alpha=0.01):
+    # compares the raw rows of a simulated probability_undetected experiment (BB84_Utils.cell_rows) with the
+    # exact probabilities, consistent is False when the exact value is outside the Clopper-Pearson interval
+    rows = []
+    for (p, k), group in df_cells.groupby(["p", "k"]):
+        successes = int(group["undetected"].sum())
+        n = len(group)
+        lower, upper = clopper_pearson(successes, n, alpha)
+        exact = probability_undetected_exact(eavesdropping_event, bit_flip_event, phase_flip_event, L_init, p, k)
+        rows.append({
+            "p": p,
+            "k": k,
+            "repetitions": n,
+            "simulated": successes / n,
+            "simulated_lower": lower,
+            "simulated_upper": upper,
+            "exact": exact,
+            "consistent": lower <= exact <= upper
+        })
+    return pd.DataFrame(rows)
@@ -0,0 +1,264 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from itertools import product
+
+import numpy as np
+from tqdm import tqdm
+
+from BB84_Distillation import distill_key
+from BB84_Profiling import Profiler
+from BB84_Protocol_v2 import BACKENDS, simulate_bb84
+from BB84_Streaming import simulate_bb84_streaming
+from BB84_Utils import mismatch_ratio_experiment
+
+# Benchmark of simulate_bb84 and of the experiment drivers, for every execution path. Results are written as JSON,
+# together with the commit they were measured on, so that runs on different commits can be compared.
+# The time of each stage of simulate_bb84 is measured with a BB84_Profiling.Profiler, see there for the stages.
+# Peak memory is the peak of the Python and NumPy allocations traced by tracemalloc during one extra run,
+# the native memory used inside Aer is not included.
+# Startup is the time to import each module in a fresh interpreter, the classical modules must not import Qiskit
+# (it is only needed by the circuit backends) and must import within their budget, the benchmark fails otherwise.
+# "python BB84_Benchmark.py --startup" only runs this check, in a few seconds.
+# Key distillation is also run without disclosed bits (a zero QBER estimate), every distilled key must be verified
+# with no residual errors, "python BB84_Benchmark.py --distillation" only runs this check on small keys.
+
+# -------------DEFINING PARAMETER RANGES
+seed = 1
+p = 0.2
+k = 0.5
+repeat = 3  # runs of each case, the fastest one is reported
+L_init_r = [100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+paths = BACKENDS + ("streaming",)
+max_L_init = {  # the slower paths only run the smaller sizes
+    "qiskit": 1000,
+    "batched": 1000,
+    "aggregated": 10 ** 5,
+    "numpy": 10 ** 7,
+    "streaming": 10 ** 7
+}
+flag_r = list(product([False, True], repeat=3))  # (eavesdropping_event, bit_flip_event, phase_flip_event)
+
+# EXPERIMENT DRIVERS
+driver_L_init = 100
+driver_p_r = np.arange(0, 1.01, 0.5)
+driver_repetition_r = range(4)
+
+# KEY DISTILLATION
+distillation_key_length_r = [10 ** 4, 10 ** 5, 10 ** 6]  # sifted key lengths
+distillation_qber = 0.03
+distillation_disclosed_r = [0.1, 0.0]  # fraction of each key disclosed, 0 leaves Cascade without a QBER estimate
+distillation_check_key_length = 10 ** 4
+
+# STARTUP
+classical_modules = ["BB84_Analytic", "BB84_Channels", "BB84_Decoy", "BB84_Distillation", "BB84_Network",
+                     "BB84_Protocol_v2", "BB84_Scheduler", "BB84_Store", "BB84_Streaming", "BB84_Sweep", "BB84_Utils"]
+startup_modules = classical_modules + ["qiskit", "qiskit_aer"]
+startup_budget = 1.0  # seconds to import a classical module
+startup_budget_scipy = 2.0  # modules needing scipy.stats at import, which alone takes most of a second
+scipy_modules = ["BB84_Analytic", "BB84_Decoy"]
+
+output_path = "results/benchmark.json"
+
+
+def time_stages(path, L_init, eavesdropping_event, bit_flip_event, phase_flip_event):
+    # runs simulate_bb84 once, returning the seconds spent in each stage and in the whole call
+    profiler = Profiler()
+    start = time.perf_counter()
+    if path == "streaming":
+        simulate_bb84_streaming(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, seed,
+                                profiler=profiler)
+    else:
+        simulate_bb84(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, seed, backend=path,
+                      profiler=profiler)
+    end = time.perf_counter()
+    return dict(profiler.totals, total=end - start)
+
+
+def peak_memory(path, L_init, eavesdropping_event, bit_flip_event, phase_flip_event):
+    tracemalloc.start()
+    try:
+        time_stages(path, L_init, eavesdropping_event, bit_flip_event, phase_flip_event)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_simulate_bb84():
+    cases = [(path, L_init, flags) for path in paths for L_init in L_init_r for flags in flag_r
+             if L_init <= max_L_init[path]]
+    records = []
+    for path, L_init, flags in tqdm(cases, desc="simulate_bb84"):
+        # the fastest of the repeated runs is the least disturbed by the rest of the machine
+        runs = [time_stages(path, L_init, *flags) for _ in range(repeat)]
+        best = min(runs, key=lambda stages: stages["total"])
+        records.append({
+            "path": path,
+            "L_init": L_init,
+            "eavesdropping_event": flags[0],
+            "bit_flip_event": flags[1],
+            "phase_flip_event": flags[2],
+            "seconds": best,
+            "bits_per_second": L_init / best["total"],
+            "peak_memory_bytes": peak_memory(path, L_init, *flags)
+        })
+    return records
+
+
+def benchmark_drivers():
+    records = []
+    for path in tqdm(BACKENDS, desc="experiment drivers"):
+        n_cells = len(driver_p_r) * len(driver_repetition_r)
+        start = time.perf_counter()
+        mismatch_ratio_experiment(True, True, False, seed, driver_L_init, driver_p_r, driver_repetition_r, path)
+        seconds = time.perf_counter() - start
+        records.append({
+            "driver": "mismatch_ratio_experiment",
+            "path": path,
+            "L_init": driver_L_init,
+            "cells": n_cells,
+            "seconds": seconds,
+            "cells_per_second": n_cells / seconds
+        })
+    return records
+
+
+def benchmark_distillation(key_length_r=distillation_key_length_r):
+    # reconciliation and privacy amplification of synthetic sifted keys with distillation_qber errors, for every
+    # disclosed fraction of distillation_disclosed_r
+    records = []
+    rng = np.random.default_rng(seed)
+    for key_length, disclosed in tqdm(list(product(key_length_r, distillation_disclosed_r)), desc="key distillation"):
+        alice_key = rng.integers(0, 2, size=key_length, dtype=np.uint8)
+        bob_key = alice_key ^ (rng.random(key_length) < distillation_qber).astype(np.uint8)
+        n_disclosed_bits = int(key_length * disclosed)
+        profiler = Profiler()
+        start = time.perf_counter()
+        result = distill_key(alice_key, bob_key, n_disclosed_bits, 2 * key_length, np.random.default_rng(seed),
+                             profiler=profiler)
+        seconds = time.perf_counter() - start
+        records.append({
+            "key_length": key_length,
+            "qber": distillation_qber,
+            "disclosed": disclosed,
+            "seconds": dict(profiler.totals, total=seconds),
+            "residual_errors": result["residual_errors"],
+            "verified": bool(result["verified"]),
+            "leaked_bits": result["leaked_bits"],
+            "final_key_length": result["final_key_length"],
+            "secret_bits_per_second": result["final_key_length"] / seconds
+        })
+    return records
+
+
+def distillation_failures(records):
+    # distilled keys left with errors, plus a key with two errors and nothing disclosed, which a single
+    # Cascade block spanning the whole key cannot correct
+    alice_key = np.random.default_rng(seed).integers(0, 2, size=1000, dtype=np.uint8)
+    bob_key = alice_key.copy()
+    bob_key[[3, 700]] ^= 1
+    result = distill_key(alice_key, bob_key, 0, 2000, np.random.default_rng(seed))
+    records = records + [{"key_length": 1000, "disclosed": 0.0, "residual_errors": result["residual_errors"],
+                          "verified": bool(result["verified"])}]
+    return [f"key of {r['key_length']} bits, {r['disclosed']} disclosed: {r['residual_errors']} residual errors"
+            for r in records if r["residual_errors"] > 0 or not r["verified"]]
+
+
+def time_import(module):
+    # seconds to import module in a new interpreter, and whether Qiskit got imported with it
+    script = (f"import sys, time; start = time.perf_counter(); import {module}; "
+              f"print(time.perf_counter() - start, 'qiskit' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+    return float(output[-2]), output[-1] == "True"
+
+
+def import_budget(module):
+    return startup_budget_scipy if module in scipy_modules else startup_budget
+
+
+def benchmark_startup():
+    # a module over its budget is timed again, up to repeat times, and its fastest run is kept
+    records = []
+    for module in tqdm(startup_modules, desc="startup"):
+        seconds, imports_qiskit = time_import(module)
+        for _ in range(repeat - 1):
+            if seconds <= import_budget(module):
+                break
+            seconds = min(seconds, time_import(module)[0])
+        records.append({
+            "module": module,
+            "seconds": seconds,
+            "imports_qiskit": imports_qiskit
+        })
+    return records
+
+
+def startup_failures(records):
+    # classical modules importing Qiskit or slower to import than their budget
+    failures = []
+    for record in records:
+        if record["module"] not in classical_modules:
+            continue
+        budget = import_budget(record["module"])
+        if record["imports_qiskit"]:
+            failures.append(f"{record['module']} imports Qiskit")
+        if record["seconds"] > budget:
+            failures.append(f"{record['module']} takes {record['seconds']:.3f} s to import (budget {budget} s)")
+    return failures
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark():
+    return {
+        "commit": current_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "startup": benchmark_startup(),
+        "simulate_bb84": benchmark_simulate_bb84(),
+        "drivers": benchmark_drivers(),
+        "distillation": benchmark_distillation()
+    }
+
+
+if __name__ == "__main__":
+    if "--startup" in sys.argv[1:]:
+        results = {"startup": benchmark_startup()}
+    elif "--distillation" in sys.argv[1:]:
+        results = {"distillation": benchmark_distillation([distillation_check_key_length])}
+    else:
+        results = run_benchmark()
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+        # summary of the largest size of every path, averaged over the scenarios
+        for path in paths:
+            records = [r for r in results["simulate_bb84"] if r["path"] == path]
+            L_init = max(r["L_init"] for r in records)
+            rates = [r["bits_per_second"] for r in records if r["L_init"] == L_init]
+            print(f"{path:<12} L_init={L_init:<10} {np.mean(rates):>14.0f} bits/s")
+        print(f"results written to {output_path}")
+
+    failures = []
+    if "startup" in results:
+        for record in results["startup"]:
+            print(f"import {record['module']:<20} {record['seconds']:>8.3f} s")
+        failures += startup_failures(results["startup"])
+    if "distillation" in results:
+        failures += distillation_failures(results["distillation"])
+    if failures:
+        raise SystemExit("checks failed:\n  " + "\n  ".join(failures))
@@ -0,0 +1,232 @@
+import numpy as np
+
+from BB84_PostProcessing import as_bits, as_x_mask
+
+# Pluggable channels and attacks for simulate_bb84(..., channel=..., attack=...).
+# Every plugin provides both:
+#   - a Qiskit circuit fragment (append), used by the circuits of the "aggregated" backend
+#   - a vectorized sampler working on the Bloch vectors of all the transmitted qubits at once, used by the "numpy"
+#     backend. Each qubit is independent, so its Bloch vector r (a row of an (n, 3) array, columns x, y, z)
+#     describes it exactly, a measurement along the unit axis a gives 0 with probability (1 + r . a) / 2
+# Channels are completely positive maps given by their Kraus operators, on Bloch vectors they act as an affine
+# map r -> M r + c. Channels compose in sequence with ComposedChannel.
+# Attacks choose a measurement setting for every qubit (none, Z, X or the Breidbart basis), measure the
+# intercepted qubits and resend the eigenstate of the outcome.
+# Plugins compare and hash by kind and parameters (key), so equal plugins built separately share the cached
+# circuit templates of the "aggregated" backend.
+# Qiskit is only imported by the circuit fragments, the samplers only need NumPy.
+
+PAULIS = {
+    "I": np.eye(2, dtype=complex),
+    "X": np.array([[0, 1], [1, 0]], dtype=complex),
+    "Y": np.array([[0, -1j], [1j, 0]], dtype=complex),
+    "Z": np.array([[1, 0], [0, -1]], dtype=complex)
+}
+
+# ----- MEASUREMENT SETTINGS -----
+# axes in the x-z plane, setting s measures along (sin(theta), 0, cos(theta)) with theta = SETTING_ANGLES[s]
+NOT_INTERCEPTED, Z_SETTING, X_SETTING, BREIDBART_SETTING = 0, 1, 2, 3
+SETTING_ANGLES = np.array([np.nan, 0.0, np.pi / 2, np.pi / 4])
+SETTING_AXES = np.column_stack([np.sin(SETTING_ANGLES), np.zeros(4), np.cos(SETTING_ANGLES)])
+Z_AXIS = SETTING_AXES[Z_SETTING]
+X_AXIS = SETTING_AXES[X_SETTING]
+
+
+def basis_axes(x_mask):
+    # measurement axis of every qubit, X for True and Z for False
+    return np.where(as_x_mask(x_mask)[:, None], X_AXIS, Z_AXIS)
+
+
+def prepare_states(bits, x_mask):
+    # Bloch vectors of the basis states encoding the bits, bit 0 along the axis and bit 1 opposite to it
+    return basis_axes(x_mask) * (1 - 2 * as_bits(bits).astype(float))[:, None]
+
+
+def measure_along(bloch, axes, rng):
+    # outcome of measuring every qubit along its axis
+    probability_one = (1 - np.einsum("ij,ij->i", bloch, axes)) / 2
+    return (rng.random(len(bloch)) < probability_one).astype(np.uint8)
+
+
+# ----- CHANNELS -----
+class KrausChannel:
+    def __init__(self, kraus_operators, name="kraus"):
+        self.kraus = [np.asarray(operator, dtype=complex) for operator in kraus_operators]
+        if not np.allclose(sum(operator.conj().T @ operator for operator in self.kraus), PAULIS["I"]):
+            raise ValueError(f"the Kraus operators of {name} are not trace preserving")
+        self.name = name
+        # affine action on Bloch vectors: M[i, j] = Tr(s_i E(s_j)) / 2, c[i] = Tr(s_i E(I)) / 2
+        paulis = [PAULIS["X"], PAULIS["Y"], PAULIS["Z"]]
+        self.matrix = np.array([[np.trace(s_i @ self.evolve(s_j)).real / 2 for s_j in paulis] for s_i in paulis])
+        self.offset = np.array([np.trace(s_i @ self.evolve(PAULIS["I"])).real / 2 for s_i in paulis])
+
+    def evolve(self, rho):
+        return sum(operator @ rho @ operator.conj().T for operator in self.kraus)
+
+    def apply(self, bloch):
+        return bloch @ self.matrix.T + self.offset
+
+    def key(self):
+        return type(self).__name__, tuple(operator.tobytes() for operator in self.kraus)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.key() == self.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def append(self, circuit, qubit):
+        from qiskit.quantum_info import Kraus
+        from qiskit_aer.noise import QuantumError
+
+        circuit.append(QuantumError(Kraus(self.kraus)), [qubit])
+
+    def __repr__(self):
+        return self.name
+
+
+class PauliChannel(KrausChannel):
+    # applies X, Y and Z with probabilities p_x, p_y and p_z, the fragment is a Pauli error so the circuits can
+    # still run with the stabilizer method
+    def __init__(self, p_x=0.0, p_y=0.0, p_z=0.0, name="pauli"):
+        self.probabilities = [("X", p_x), ("Y", p_y), ("Z", p_z), ("I", 1 - p_x - p_y - p_z)]
+        super().__init__([np.sqrt(p) * PAULIS[operator] for operator, p in self.probabilities if p > 0], name)
+
+    def append(self, circuit, qubit):
+        from qiskit_aer.noise import pauli_error
+
+        circuit.append(pauli_error([(operator, p) for operator, p in self.probabilities if p > 0]), [qubit])
+
+
+class ComposedChannel:
+    # channels applied one after the other
+    def __init__(self, *channels):
+        self.channels = channels
+
+    def apply(self, bloch):
+        for channel in self.channels:
+            bloch = channel.apply(bloch)
+        return bloch
+
+    def append(self, circuit, qubit):
+        for channel in self.channels:
+            channel.append(circuit, qubit)
+
+    def key(self):
+        return type(self).__name__, tuple(channel.key() for channel in self.channels)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.key() == self.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return " -> ".join(repr(channel) for channel in self.channels)
+
+
+def bit_flip(p):
+    return PauliChannel(p_x=p, name=f"bit_flip({p})")
+
+
+def phase_flip(p):
+    return PauliChannel(p_z=p, name=f"phase_flip({p})")
+
+
+def bit_phase_flip(p):
+    return PauliChannel(p_y=p, name=f"bit_phase_flip({p})")
+
+
+def depolarizing(p):
+    # rho -> (1 - p) rho + p / 3 (X rho X + Y rho Y + Z rho Z)
+    return PauliChannel(p / 3, p / 3, p / 3, name=f"depolarizing({p})")
+
+
+def amplitude_damping(gamma):
+    # |1> decays to |0> with probability gamma
+    return KrausChannel([[[1, 0], [0, np.sqrt(1 - gamma)]], [[0, np.sqrt(gamma)], [0, 0]]],
+                        name=f"amplitude_damping({gamma})")
+
+
+# ----- ATTACKS -----
+class InterceptResend:
+    # eve intercepts each qubit with probability fraction, measures it in her basis (eve_basis of simulate_bb84)
+    # and resends the state she found
+    def __init__(self, fraction=1.0):
+        self.fraction = fraction
+
+    def key(self):
+        return type(self).__name__, self.fraction
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.key() == self.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def measurement_bases(self, eve_basis):
+        return np.where(as_x_mask(eve_basis), X_SETTING, Z_SETTING)
+
+    def settings(self, eve_basis, rng):
+        settings = self.measurement_bases(eve_basis)
+        if self.fraction < 1:
+            settings = np.where(rng.random(len(settings)) < self.fraction, settings, NOT_INTERCEPTED)
+        return settings
+
+    def sample(self, bloch, settings, rng):
+        # eve's outcomes (0 for the qubits she lets through) and the Bloch vectors of the qubits sent on
+        intercepted = settings != NOT_INTERCEPTED
+        axes = SETTING_AXES[settings]
+        eve_bits = np.zeros(len(bloch), dtype=np.uint8)
+        eve_bits[intercepted] = measure_along(bloch[intercepted], axes[intercepted], rng)
+        resent = bloch.copy()
+        resent[intercepted] = axes[intercepted] * (1 - 2 * eve_bits[intercepted].astype(float))[:, None]
+        return eve_bits, resent
+
+    def append(self, circuit, channel, eavesdropper_channel, eve_measurement, setting):
+        # measures channel along the axis of the setting and prepares the same eigenstate on eavesdropper_channel,
+        # returns the qubit that travels on to bob
+        if setting == NOT_INTERCEPTED:
+            return channel
+        theta = SETTING_ANGLES[setting]
+        if theta:
+            circuit.ry(-theta, channel)
+        circuit.measure(channel, eve_measurement)
+        with circuit.if_test((eve_measurement, 1)):
+            circuit.x(eavesdropper_channel)
+        if theta:
+            circuit.ry(theta, eavesdropper_channel)
+        return eavesdropper_channel
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.fraction})"
+
+
+class Breidbart(InterceptResend):
+    # intercept-resend in the Breidbart basis, halfway between Z and X: eve guesses alice's bit right with
+    # probability cos(pi / 8) ** 2 whatever basis alice used, and causes the same error rate as measuring in Z or X
+    def measurement_bases(self, eve_basis):
+        return np.full(len(eve_basis), BREIDBART_SETTING)
+
+
+def sample_plugin_transmissions(alice_bits, alice_basis, settings, bob_basis, channel, attack, rng):
+    # numpy backend of the plugins: eve's and bob's outcomes of all the transmissions, settings are those drawn by
+    # attack.settings. Without an attack eve's bits are empty, like in sample_transmissions
+    bloch = prepare_states(alice_bits, alice_basis)
+    eve_bits = np.empty(0, dtype=np.uint8)
+    if attack is not None:
+        eve_bits, bloch = attack.sample(bloch, settings, rng)
+    if channel is not None:
+        bloch = channel.apply(bloch)
+    return eve_bits, measure_along(bloch, basis_axes(bob_basis), rng)
+
+
+def flag_channel(bit_flip_event, phase_flip_event, p):
+    # the channel of the bit_flip_event and phase_flip_event flags of simulate_bb84, None for an ideal channel
+    if bit_flip_event and phase_flip_event:
+        return bit_phase_flip(p)
+    elif bit_flip_event:
+        return bit_flip(p)
+    elif phase_flip_event:
+        return phase_flip(p)
+    return None
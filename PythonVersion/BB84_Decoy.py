@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from BB84_PostProcessing import binary_entropy
+
+# Decoy-state BB84 with a weak coherent pulse source (vacuum + weak decoy method of Ma, Qi, Zhao and Lo, 2005),
+# evaluated in closed form instead of simulating single photons. Every function works elementwise on NumPy arrays
+# that broadcast together, so a whole grid of (distance, signal intensity, block size, ...) is a single call.
+# The source sends N pulses, each one with the signal intensity mu, the decoy intensity nu or vacuum with
+# probabilities p_mu, p_nu and 1 - p_mu - p_nu. Alice's and Bob's bases match for half of them.
+# Channel and detectors:
+#   transmittance   eta = 10 ** (-attenuation * distance / 10) * detector_efficiency
+#   gain            Q = Y0 + 1 - exp(-eta * intensity), Y0 the dark count probability
+#   error gain      E * Q = e0 * Y0 + misalignment * (1 - exp(-eta * intensity)), e0 = 1/2
+# The defaults are those of the GYS experiment used by Ma et al.
+# Finite-key: the gains measured on a block deviate from the expected ones, every measured gain is replaced by
+# the worst of gain -/+ n_sigma * sqrt(gain / pulses) (n_sigma such that each bound fails with probability
+# epsilon_pe), the single photon phase error gets a sampling correction sqrt(ln(1 / epsilon_pe) / (2 s1)), and
+# the key loses 6 log2(21 / epsilon_sec) + log2(2 / epsilon_cor) bits. With N = np.inf all these terms vanish
+# and the asymptotic rate is returned.
+ATTENUATION_DB_PER_KM = 0.21
+DETECTOR_EFFICIENCY = 0.045
+DARK_COUNT = 1.7e-6
+MISALIGNMENT = 0.033
+EC_EFFICIENCY = 1.22
+EPSILON_PE = 1e-10
+EPSILON_SEC = 1e-10
+EPSILON_COR = 1e-15
+
+
+def transmittance(distance_km, attenuation=ATTENUATION_DB_PER_KM, detector_efficiency=DETECTOR_EFFICIENCY):
+    return 10 ** (-attenuation * np.asarray(distance_km, dtype=float) / 10) * detector_efficiency
+
+
+def expected_gains(intensity, eta, dark_count=DARK_COUNT, misalignment=MISALIGNMENT):
+    # gain and error gain of the pulses of the given intensity
+    detected = 1 - np.exp(-eta * intensity)
+    return dark_count + detected, 0.5 * dark_count + misalignment * detected
+
+
+def sample_gains(intensity, eta, pulses, rng, dark_count=DARK_COUNT, misalignment=MISALIGNMENT):
+    # gains measured on a block of the given number of sifted pulses of the given intensity, the detections and
+    # the errors are drawn from their binomial distributions
+    gain, error_gain = expected_gains(intensity, eta, dark_count, misalignment)
+    pulses = np.broadcast_to(pulses, np.broadcast(gain, pulses).shape).astype(np.int64)
+    detections = rng.binomial(pulses, np.broadcast_to(gain, pulses.shape))
+    errors = rng.binomial(detections, np.broadcast_to(error_gain / gain, pulses.shape))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return detections / pulses, errors / pulses
+
+
+def fluctuation(gain, pulses, n_sigma, sign):
+    # gain shifted by n_sigma standard deviations of the measured count, towards the worse side
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = np.where(np.isinf(pulses), 0.0, n_sigma * np.sqrt(gain / pulses))
+    return np.maximum(gain + sign * delta, 0.0)
+
+
+def decoy_key_rate(distance_km, mu, N, nu=0.1, p_mu=0.8, p_nu=0.1, attenuation=ATTENUATION_DB_PER_KM,
+                   detector_efficiency=DETECTOR_EFFICIENCY, dark_count=DARK_COUNT, misalignment=MISALIGNMENT,
+                   ec_efficiency=EC_EFFICIENCY, epsilon_pe=EPSILON_PE, epsilon_sec=EPSILON_SEC,
+                   epsilon_cor=EPSILON_COR, rng=None):
+    # secret key bits per sent pulse and the estimated quantities, as a dict of arrays with the broadcast shape of
+    # the arguments. With rng the gains of the finite blocks are sampled (sample_gains), otherwise the expected ones
+    # are used
+    mu, nu, N = np.asarray(mu, dtype=float), np.asarray(nu, dtype=float), np.asarray(N, dtype=float)
+    eta = transmittance(distance_km, attenuation, detector_efficiency)
+    with np.errstate(invalid="ignore"):
+        sifted = {name: np.where(np.isinf(N), np.inf, N * fraction / 2)
+                  for name, fraction in [("mu", p_mu), ("nu", p_nu), ("vacuum", 1 - p_mu - p_nu)]}
+    gains = {}
+    for name, intensity in [("mu", mu), ("nu", nu), ("vacuum", np.zeros_like(mu))]:
+        gains[name] = expected_gains(intensity, eta, dark_count, misalignment)
+        if rng is not None:
+            # only the finite blocks are sampled, the points with N = inf keep the expected gains
+            asymptotic = np.isinf(sifted[name])
+            sampled = sample_gains(intensity, eta, np.where(asymptotic, 0.0, sifted[name]), rng, dark_count,
+                                   misalignment)
+            gains[name] = tuple(np.where(asymptotic, expected, measured)
+                                for expected, measured in zip(gains[name], sampled))
+    Q_mu, EQ_mu = gains["mu"]
+    Q_nu, EQ_nu = gains["nu"]
+    Q_vac, EQ_vac = gains["vacuum"]
+
+    # ----- PARAMETER ESTIMATION -----
+    n_sigma = norm.isf(epsilon_pe)
+    Y0_upper = fluctuation(Q_vac, sifted["vacuum"], n_sigma, 1)
+    Y0_lower = fluctuation(Q_vac, sifted["vacuum"], n_sigma, -1)
+    Q_mu_upper = fluctuation(Q_mu, sifted["mu"], n_sigma, 1)
+    Q_nu_lower = fluctuation(Q_nu, sifted["nu"], n_sigma, -1)
+    EQ_nu_upper = fluctuation(EQ_nu, sifted["nu"], n_sigma, 1)
+
+    # lower bound of the single photon yield and upper bound of its error rate, the bounds need 0 < nu < mu
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Y1 = mu / (mu * nu - nu ** 2) * (Q_nu_lower * np.exp(nu) - Q_mu_upper * np.exp(mu) * nu ** 2 / mu ** 2
+                                         - (mu ** 2 - nu ** 2) / mu ** 2 * Y0_upper)
+        Y1 = np.where((nu > 0) & (nu < mu), np.maximum(Y1, 0.0), 0.0)
+        e1 = np.clip((EQ_nu_upper * np.exp(nu) - 0.5 * Y0_lower) / (Y1 * nu), 0.0, 0.5)
+        E_mu = np.where(Q_mu > 0, EQ_mu / Q_mu, 0.5)
+
+    # ----- KEY LENGTH -----
+    # sifted signal bits coming from vacuum and single photon pulses, per sent pulse
+    s0 = p_mu / 2 * np.exp(-mu) * Y0_lower
+    s1 = p_mu / 2 * mu * np.exp(-mu) * Y1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        phase_error = np.where(np.isinf(N), e1, e1 + np.sqrt(np.log(1 / epsilon_pe) / (2 * s1 * N)))
+    phase_error = np.clip(np.nan_to_num(phase_error, nan=0.5), 0.0, 0.5)
+    leaked = ec_efficiency * p_mu / 2 * Q_mu * binary_entropy(E_mu)
+    security = np.where(np.isinf(N), 0.0, (6 * np.log2(21 / epsilon_sec) + np.log2(2 / epsilon_cor)) / N)
+    rate = np.maximum(s0 + s1 * (1 - binary_entropy(phase_error)) - leaked - security, 0.0)
+
+    return {
+        "transmittance": eta,
+        "Q_mu": Q_mu,
+        "E_mu": E_mu,
+        "Y1": Y1,
+        "e1": e1,
+        "phase_error": phase_error,
+        "key_rate": rate,
+        "key_length": np.where(np.isinf(N), np.inf, np.floor(rate * np.where(np.isinf(N), 0.0, N)))
+    }
+
+
+def decoy_sweep(distance_r, mu_r, N_r, **parameters):
+    # key rates of every (distance, mu, N) of the grid, one row each
+    distance, mu, N = np.meshgrid(np.asarray(distance_r, dtype=float), np.asarray(mu_r, dtype=float),
+                                  np.asarray(N_r, dtype=float), indexing="ij")
+    result = decoy_key_rate(distance, mu, N, **parameters)
+    df = pd.DataFrame({"distance_km": distance.ravel(), "mu": mu.ravel(), "N": N.ravel()})
+    for name, values in result.items():
+        df[name] = np.broadcast_to(values, distance.shape).ravel()
+    return df
+
+
+def optimal_intensity(distance_r, mu_r, N_r, **parameters):
+    # signal intensity of mu_r maximizing the key rate at every (distance, N), one row each
+    df = decoy_sweep(distance_r, mu_r, N_r, **parameters)
+    best = df.loc[df.groupby(["distance_km", "N"])["key_rate"].idxmax()]
+    return best.reset_index(drop=True)
@@ -0,0 +1,183 @@
+import numpy as np
+from scipy.fft import irfft, next_fast_len, rfft
+
+from BB84_PostProcessing import as_bits, binary_entropy, sift
+from BB84_Profiling import stage
+from BB84_Protocol_v2 import transmit_bits
+from BB84_Sampling import party_generators
+
+# Key distillation after sifting: error reconciliation with Cascade and privacy amplification with Toeplitz hashing.
+# The disclosed prefix of the sifted key (see BB84_PostProcessing.sift_and_estimate) is public and is dropped,
+# the rest is reconciled, verified and hashed down to the final secret key.
+# Keys are kept bit-packed in uint64 words (pack_bits) between the stages and compared with popcounts.
+# Cascade bisects all the odd blocks of a pass at once on prefix sums of the error pattern, the Toeplitz product
+# is an FFT convolution, so both scale as O(n log n) up to keys of millions of bits.
+# Leaked bits are all the parities disclosed by Cascade plus the verification hash. The final length is
+#   n * (1 - h(qber)) - leaked bits - 2 * log2(1 / epsilon_pa)
+# with h the binary entropy and qber the error rate found by Cascade, the secret key rate is the final length
+# divided by the transmitted bits.
+CASCADE_PASSES = 4
+CASCADE_MIN_QBER = 0.01  # floor of the estimate sizing the first blocks, the disclosed sample may show no errors
+VERIFICATION_BITS = 64
+EPSILON_PA = 1e-10
+
+
+# ----- BIT PACKING -----
+def pack_bits(bits):
+    # uint8 array of 0/1 -> uint64 words, the last word is padded with zeros
+    packed = np.packbits(as_bits(bits))
+    padded = np.zeros(-(-len(packed) // 8) * 8, dtype=np.uint8)
+    padded[:len(packed)] = packed
+    return padded.view(np.uint64)
+
+
+def unpack_bits(words, n):
+    return np.unpackbits(words.view(np.uint8))[:n]
+
+
+def count_differences(words_a, words_b):
+    return int(np.bitwise_count(words_a ^ words_b).sum())
+
+
+# ----- ERROR RECONCILIATION -----
+def bisect_blocks(error, order, starts, ends):
+    # binary search of one error in each of the given blocks of odd parity (disjoint ranges of order), all the
+    # blocks are halved together. Returns the positions found and the parities disclosed
+    prefix = np.concatenate([[0], np.cumsum(error[order], dtype=np.int64)])
+    lo = starts.copy()
+    hi = ends.copy()
+    leaked = 0
+    active = hi - lo > 1
+    while active.any():
+        mid = (lo + hi) // 2
+        left_odd = (prefix[mid] - prefix[lo]) % 2 == 1
+        leaked += int(np.count_nonzero(active))
+        hi = np.where(active & left_odd, mid, hi)
+        lo = np.where(active & ~left_odd, mid, lo)
+        active = hi - lo > 1
+    return order[lo], leaked
+
+
+def cascade(alice_key, bob_key, qber_estimate, rng, passes=CASCADE_PASSES):
+    # corrects bob's key towards alice's, returns the corrected key and the number of parities disclosed.
+    # Only the error pattern alice_key ^ bob_key matters to the simulation, every parity alice sends is counted
+    error = as_bits(alice_key) ^ as_bits(bob_key)
+    n = len(error)
+    leaked = 0
+    if n == 0:
+        return as_bits(bob_key).copy(), leaked
+
+    # first block size of the original Cascade, doubled at every pass. Blocks stay below half of the key: a single
+    # block has the same parity under every permutation, so it would never find an even number of errors
+    max_block_size = max(n // 2, 1)
+    block_size = int(np.clip(0.73 / max(qber_estimate, CASCADE_MIN_QBER), 1, max_block_size))
+    orders, positions, block_sizes, odd = [], [], [], []
+    for i in range(passes):
+        order = np.arange(n) if i == 0 else rng.permutation(n)
+        position = np.empty(n, dtype=np.int64)
+        position[order] = np.arange(n)
+        starts = np.arange(0, n, block_size)
+        parities = np.add.reduceat(error[order], starts) % 2
+        leaked += len(starts)
+        orders.append(order)
+        positions.append(position)
+        block_sizes.append(block_size)
+        odd.append(parities == 1)
+
+        # bisect the odd blocks of every pass so far, each correction flips the parity of the block holding the
+        # corrected bit in every other pass, which may become odd in turn
+        while any(o.any() for o in odd):
+            for j in range(len(odd)):
+                blocks = np.flatnonzero(odd[j])
+                if len(blocks) == 0:
+                    continue
+                starts = blocks * block_sizes[j]
+                ends = np.minimum(starts + block_sizes[j], n)
+                corrected, bisect_leak = bisect_blocks(error, orders[j], starts, ends)
+                leaked += bisect_leak
+                error[corrected] ^= 1
+                for l in range(len(odd)):
+                    flips = np.bincount(positions[l][corrected] // block_sizes[l], minlength=len(odd[l]))
+                    odd[l] ^= flips % 2 == 1
+        block_size = min(2 * block_size, max_block_size)
+
+    return as_bits(alice_key) ^ error, leaked
+
+
+# ----- PRIVACY AMPLIFICATION -----
+def toeplitz_hash(bits, seed_bits, m):
+    # product of the m x n Toeplitz matrix T[i, j] = seed_bits[i - j + n - 1] with the bits, modulo 2.
+    # It is the slice n - 1 : n - 1 + m of the full convolution of seed_bits and bits, computed with real FFTs,
+    # the integer sums are at most n so rounding is exact for any practical key length
+    n = len(bits)
+    if m <= 0 or n == 0:
+        return np.zeros(max(m, 0), dtype=np.uint8)
+    size = next_fast_len(n + len(seed_bits) - 1, real=True)
+    full = irfft(rfft(as_bits(bits), size) * rfft(as_bits(seed_bits), size), size)[n - 1:n - 1 + m]
+    rounded = np.rint(full)
+    if np.abs(full - rounded).max() > 0.25:
+        raise ValueError(f"FFT rounding error too large for a key of {n} bits")
+    return (rounded.astype(np.int64) % 2).astype(np.uint8)
+
+
+def distill_key(alice_quantum_key, bob_quantum_key, n_disclosed_bits, L_init, rng, passes=CASCADE_PASSES,
+                epsilon_pa=EPSILON_PA, profiler=None):
+    # reconciliation, verification and privacy amplification of the undisclosed part of the sifted keys,
+    # rng is the public randomness (Cascade permutations and hash seeds)
+    alice_key = as_bits(alice_quantum_key)[n_disclosed_bits:]
+    bob_key = as_bits(bob_quantum_key)[n_disclosed_bits:]
+    n = len(alice_key)
+
+    # error rate estimated on the disclosed bits, used to size the first Cascade blocks
+    disclosed = as_bits(alice_quantum_key)[:n_disclosed_bits] != as_bits(bob_quantum_key)[:n_disclosed_bits]
+    qber_estimate = float(disclosed.mean()) if n_disclosed_bits > 0 else 0.0
+
+    # ----- ERROR RECONCILIATION -----
+    with stage(profiler, "reconciliation"):
+        alice_words = pack_bits(alice_key)
+        corrected_key, leaked = cascade(alice_key, bob_key, qber_estimate, rng, passes)
+        corrected_words = pack_bits(corrected_key)
+        qber = count_differences(pack_bits(bob_key), corrected_words) / n if n > 0 else 0.0
+        residual_errors = count_differences(alice_words, corrected_words)
+
+        # alice and bob compare a short hash of their keys, a mismatch aborts the protocol
+        verification_seed = rng.integers(0, 2, size=n + VERIFICATION_BITS - 1, dtype=np.uint8)
+        verified = np.array_equal(toeplitz_hash(alice_key, verification_seed, VERIFICATION_BITS),
+                                  toeplitz_hash(corrected_key, verification_seed, VERIFICATION_BITS))
+        leaked += VERIFICATION_BITS
+
+    # ----- PRIVACY AMPLIFICATION -----
+    with stage(profiler, "privacy_amplification"):
+        final_length = int(n * (1 - binary_entropy(qber)) - leaked - 2 * np.log2(1 / epsilon_pa))
+        final_length = max(final_length, 0) if verified else 0
+        hash_seed = rng.integers(0, 2, size=max(n + final_length - 1, 0), dtype=np.uint8)
+        alice_final = pack_bits(toeplitz_hash(alice_key, hash_seed, final_length))
+        bob_final = pack_bits(toeplitz_hash(corrected_key, hash_seed, final_length))
+
+    return {
+        "key_length": n,
+        "qber": qber,
+        "residual_errors": residual_errors,
+        "verified": verified,
+        "leaked_bits": leaked,
+        "final_key_length": final_length,
+        "secret_key_rate": final_length / L_init,
+        "keys_match": count_differences(alice_final, bob_final) == 0,
+        "alice_key": alice_final,
+        "bob_key": bob_final
+    }
+
+
+def simulate_bb84_key(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, seed_gen,
+                      backend="numpy", batch_size=100, passes=CASCADE_PASSES, epsilon_pa=EPSILON_PA, profiler=None):
+    # simulate_bb84 followed by key distillation, returns the dict of distill_key.
+    # The public randomness comes from the "public" generator of party_generators
+    generators = party_generators(seed_gen)
+    alice_bits, alice_basis, eve_basis, eve_bits, bob_bits, bob_basis = transmit_bits(
+        L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, seed_gen, generators, backend, batch_size,
+        profiler=profiler)
+    with stage(profiler, "post_processing"):
+        alice_quantum_key, bob_quantum_key = sift(alice_bits, alice_basis, bob_bits, bob_basis)
+        n_disclosed_bits = int(len(alice_quantum_key) * k)
+    return distill_key(alice_quantum_key, bob_quantum_key, n_disclosed_bits, L_init, generators["public"], passes,
+                       epsilon_pa, profiler)
@@ -0,0 +1,166 @@
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+
+from BB84_Distillation import distill_key
+from BB84_PostProcessing import detection_threshold, sift
+from BB84_Protocol_v2 import transmit_bits
+from BB84_Sampling import party_generators
+from BB84_Utils import cell_executor
+
+# Network of concurrent BB84 links, e.g. the links of a trusted-node network. Every link runs a number of key
+# generation rounds (blocks) of L_init transmitted bits, each block goes through three pipelined stages connected
+# by bounded queues:
+#   transmission    transmit_bits in a process pool, one producer per link
+#   sifting         sift in the event loop
+#   estimation      disclosure, eavesdropping detection and, for links with distill=True, key distillation
+#                   (BB84_Distillation), in the process pool
+# A full queue blocks the stage feeding it, so the blocks in flight stay bounded however many links run.
+# Block b of a link uses the seed seed + b * L_init. Latency is the time from the start of the transmission of a
+# block to the end of its estimation, the key rate is the secret key bits of a link per second of wall time.
+
+
+def link(name, L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, seed, backend="numpy",
+         distill=False):
+    return {
+        "name": name,
+        "L_init": L_init,
+        "eavesdropping_event": eavesdropping_event,
+        "bit_flip_event": bit_flip_event,
+        "phase_flip_event": phase_flip_event,
+        "p": p,
+        "k": k,
+        "seed": seed,
+        "backend": backend,
+        "distill": distill
+    }
+
+
+def transmit_block(link, block):
+    # quantum stage of one block, runs in a worker process
+    seed_gen = link["seed"] + block * link["L_init"]
+    alice_bits, alice_basis, eve_basis, eve_bits, bob_bits, bob_basis = transmit_bits(
+        link["L_init"], link["eavesdropping_event"], link["bit_flip_event"], link["phase_flip_event"], link["p"],
+        seed_gen, party_generators(seed_gen), link["backend"])
+    return alice_bits, alice_basis, bob_bits, bob_basis
+
+
+def warm_up(circuits):
+    # starts a worker and imports this module in it, and Qiskit and Aer when a link runs on a circuit backend (they
+    # are imported lazily by BB84_Protocol_v2), so that this startup is not counted in the key rates and latencies
+    if circuits:
+        import qiskit
+        import qiskit_aer
+    return None
+
+
+def estimate_block(link, block, alice_quantum_key, bob_quantum_key):
+    # eavesdropping detection on the disclosed bits of the sifted key, the key of a block where eve is detected
+    # is discarded. Without distillation the secret bits are the undisclosed sifted bits
+    n_disclosed_bits = int(len(alice_quantum_key) * link["k"])
+    n_mismatched_key_bits = int(np.count_nonzero(alice_quantum_key[:n_disclosed_bits]
+                                                 != bob_quantum_key[:n_disclosed_bits]))
+    threshold = detection_threshold(n_disclosed_bits, link["bit_flip_event"], link["phase_flip_event"], link["p"])
+    eve_detected = n_mismatched_key_bits > threshold
+
+    secret_bits = 0
+    if not eve_detected:
+        secret_bits = len(alice_quantum_key) - n_disclosed_bits
+        if link["distill"]:
+            rng = party_generators(link["seed"] + block * link["L_init"])["public"]
+            secret_bits = distill_key(alice_quantum_key, bob_quantum_key, n_disclosed_bits, link["L_init"],
+                                      rng)["final_key_length"]
+    return eve_detected, secret_bits
+
+
+async def run_network(links, n_blocks, executor, queue_size):
+    loop = asyncio.get_running_loop()
+    sifting_queue = asyncio.Queue(queue_size)
+    estimation_queue = asyncio.Queue(queue_size)
+    records = []
+
+    async def transmission(i):
+        for block in range(n_blocks):
+            start = time.perf_counter()
+            transmitted = await loop.run_in_executor(executor, transmit_block, links[i], block)
+            await sifting_queue.put((i, block, start, transmitted))
+
+    async def sifting():
+        while (item := await sifting_queue.get()) is not None:
+            i, block, start, (alice_bits, alice_basis, bob_bits, bob_basis) = item
+            alice_quantum_key, bob_quantum_key = sift(alice_bits, alice_basis, bob_bits, bob_basis)
+            await estimation_queue.put((i, block, start, alice_quantum_key, bob_quantum_key))
+
+    async def estimation():
+        while (item := await estimation_queue.get()) is not None:
+            i, block, start, alice_quantum_key, bob_quantum_key = item
+            eve_detected, secret_bits = await loop.run_in_executor(executor, estimate_block, links[i], block,
+                                                                   alice_quantum_key, bob_quantum_key)
+            records.append({
+                "link": links[i]["name"],
+                "block": block,
+                "sifted_bits": len(alice_quantum_key),
+                "eve_detected": eve_detected,
+                "secret_bits": secret_bits,
+                "start": start,
+                "end": time.perf_counter()
+            })
+
+    # one estimation consumer per link, so that estimation keeps up with the producers
+    sifter = asyncio.create_task(sifting())
+    estimators = [asyncio.create_task(estimation()) for _ in links]
+    await asyncio.gather(*(transmission(i) for i in range(len(links))))
+    await sifting_queue.put(None)
+    await sifter
+    for _ in estimators:
+        await estimation_queue.put(None)
+    await asyncio.gather(*estimators)
+    return records
+
+
+def link_summary(links, df_blocks, start):
+    rows = []
+    for link in links:
+        blocks = df_blocks[df_blocks["link"] == link["name"]]
+        latency = blocks["end"] - blocks["start"]
+        seconds = blocks["end"].max() - start
+        rows.append({
+            "link": link["name"],
+            "blocks": len(blocks),
+            "transmitted_bits": len(blocks) * link["L_init"],
+            "sifted_bits": int(blocks["sifted_bits"].sum()),
+            "detected_blocks": int(blocks["eve_detected"].sum()),
+            "secret_bits": int(blocks["secret_bits"].sum()),
+            "secret_key_rate": blocks["secret_bits"].sum() / (len(blocks) * link["L_init"]),
+            "key_rate_bps": blocks["secret_bits"].sum() / seconds,
+            "latency_mean_s": latency.mean(),
+            "latency_p95_s": latency.quantile(0.95)
+        })
+    return pd.DataFrame(rows)
+
+
+def simulate_network(links, n_blocks, workers=None, queue_size=None):
+    # runs n_blocks blocks of every link concurrently, returns the summary of every link (key rates and latencies)
+    # and the record of every block. queue_size bounds each queue, by default to the number of links.
+    # The pool is spawned like the one of the experiments (see BB84_Utils.cell_executor), without workers the
+    # stages run in the default thread pool of the event loop
+    if len({link["name"] for link in links}) != len(links):
+        raise ValueError("link names must be unique")
+    executor = cell_executor(workers)
+    circuits = any(link["backend"] != "numpy" for link in links)
+    if executor is not None:
+        list(executor.map(warm_up, [circuits] * workers))
+    else:
+        warm_up(circuits)
+    start = time.perf_counter()
+    try:
+        records = asyncio.run(run_network(links, n_blocks, executor, queue_size or len(links)))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    df_blocks = pd.DataFrame(records, columns=["link", "block", "sifted_bits", "eve_detected", "secret_bits", "start",
+                                               "end"])
+    df_blocks = df_blocks.sort_values(["link", "block"], ignore_index=True)
+    return link_summary(links, df_blocks, start), df_blocks
@@ -0,0 +1,126 @@
+import numpy as np
+
+# Classical post-processing of the protocol (sifting, partial key disclosure and mismatch ratios) on compact arrays:
+# bits are uint8 arrays and bases are boolean masks, True for the X basis and False for the Z basis.
+# Sequences of "Z"/"X" strings and of ints are accepted as well and converted on the way in.
+
+
+def as_bits(bits):
+    return np.asarray(bits, dtype=np.uint8)
+
+
+def as_x_mask(basis):
+    # True for the X basis: bases are booleans, numbers (nonzero for X) or the strings "Z" and "X"
+    basis = np.asarray(basis)
+    if basis.dtype == bool:
+        return basis
+    if basis.dtype.kind in "iuf":
+        return basis.astype(bool)
+    if basis.dtype.kind in "USO":
+        x_mask = basis == "X"
+        if np.all(x_mask | (basis == "Z")):
+            return np.asarray(x_mask, dtype=bool)
+    raise TypeError(f"bases must be booleans, numbers or the strings 'Z' and 'X', got {basis.dtype} values")
+
+
+def sift(alice_bits, alice_basis, bob_bits, bob_basis):
+    # sift the key by taking only the bits correspondant to the same basis (between Alice and Bob)
+    same_basis = as_x_mask(alice_basis) == as_x_mask(bob_basis)
+    return as_bits(alice_bits)[same_basis], as_bits(bob_bits)[same_basis]
+
+
+def count_mismatches(alice_bits, alice_basis, bob_bits, bob_basis):
+    # counters needed by the mismatch ratios, they can be summed over separate blocks of transmitted bits
+    alice_bits = as_bits(alice_bits)
+    bob_bits = as_bits(bob_bits)
+    alice_x = as_x_mask(alice_basis)
+    same_basis = alice_x == as_x_mask(bob_basis)
+
+    # counting mismatches
+    mismatch = alice_bits != bob_bits
+    x_total_count = int(np.count_nonzero(alice_x))
+    global_mismatch_count = int(np.count_nonzero(mismatch))
+    x_mismatch_count = int(np.count_nonzero(mismatch & alice_x))
+    return {
+        "transmitted": len(alice_bits),
+        "z_total": len(alice_bits) - x_total_count,
+        "x_total": x_total_count,
+        "global_mismatch": global_mismatch_count,
+        "z_mismatch": global_mismatch_count - x_mismatch_count,
+        "x_mismatch": x_mismatch_count,
+        "sifted": int(np.count_nonzero(same_basis)),
+        "sifted_mismatch": int(np.count_nonzero(mismatch & same_basis))
+    }
+
+
+def mismatch_ratios(counts):
+    global_mismatch_ratio = counts["global_mismatch"] / counts["transmitted"]
+    z_mismatch_ratio = counts["z_mismatch"] / counts["z_total"]
+    x_mismatch_ratio = counts["x_mismatch"] / counts["x_total"]
+    return global_mismatch_ratio, z_mismatch_ratio, x_mismatch_ratio
+
+
+def binary_entropy(x):
+    # h(x) = -x log2(x) - (1 - x) log2(1 - x) elementwise, 0 outside (0, 1)
+    x = np.asarray(x, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        h = -x * np.log2(x) - (1 - x) * np.log2(1 - x)
+    return np.where((x > 0) & (x < 1), h, 0.0)
+
+
+def detection_threshold(n_disclosed_bits, bit_flip_event, phase_flip_event, p):
+    # computing threshold by considering the average amount of mismatched bits that we expect by considering
+    # the error probability p
+    threshold = 0
+    if (not bit_flip_event and phase_flip_event) or (bit_flip_event and not phase_flip_event):
+        threshold = int(n_disclosed_bits * (p / 2))
+    elif bit_flip_event and phase_flip_event:
+        threshold = int(n_disclosed_bits * p)
+    return threshold
+
+
+def sift_and_estimate(alice_bits, alice_basis, bob_bits, bob_basis, k, p, bit_flip_event=False, phase_flip_event=False,
+                      verbose=False):
+    alice_bits = as_bits(alice_bits)
+    bob_bits = as_bits(bob_bits)
+    alice_x = as_x_mask(alice_basis)
+    bob_x = as_x_mask(bob_basis)
+
+    # ----- QUANTUM KEY DERIVATION -----
+    alice_quantum_key, bob_quantum_key = sift(alice_bits, alice_x, bob_bits, bob_x)
+    if verbose:
+        print("Alice's quantum key:\t", alice_quantum_key.tolist())
+        print("Bob's quantum key:\t", bob_quantum_key.tolist())
+        print("Key length:\t", len(alice_quantum_key))
+
+    # ----- PARTIAL QUANTUM KEY DISCLOSURE FOR EAVESDROPPING DETECTION -----
+    # disclose k * (length of quantum key) bits to check how many bits mismatch
+    n_disclosed_bits = int(len(alice_quantum_key) * k)
+    disclosed_mismatch = alice_quantum_key[:n_disclosed_bits] != bob_quantum_key[:n_disclosed_bits]
+    n_mismatched_key_bits = int(np.count_nonzero(disclosed_mismatch))
+    if verbose:
+        print("mismatched disclosed key bits:\t", n_mismatched_key_bits)
+
+    # ----- COMPUTATIONS OF RATIOS -----
+    counts = count_mismatches(alice_bits, alice_x, bob_bits, bob_x)
+    global_mismatch_count = counts["global_mismatch"]
+    global_mismatch_ratio, z_mismatch_ratio, x_mismatch_ratio = mismatch_ratios(counts)
+
+    if verbose:
+        print("Global mismatch ratio:\t", global_mismatch_ratio)
+        print("Z mismatch ratio:\t", z_mismatch_ratio)
+        print("X mismatch ratio:\t", x_mismatch_ratio)
+        print("Mismatched bits:\t", global_mismatch_count)
+
+    # ----- EAVESDROPPING DETECTION -----
+    # if the threshold is lower than the amount of mismatched disclosed bits, we
+    # conclude that eavesdropping has taken place
+    threshold = detection_threshold(n_disclosed_bits, bit_flip_event, phase_flip_event, p)
+    eve_detected = n_mismatched_key_bits > threshold
+
+    if verbose:
+        print("Disclosed bits:\t\t", n_disclosed_bits)
+        print("Threshold:\t\t", threshold)
+        print("Eve detected:\t", eve_detected)
+
+    return global_mismatch_ratio, z_mismatch_ratio, x_mismatch_ratio, eve_detected
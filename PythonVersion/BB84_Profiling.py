@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Optional instrumentation of simulate_bb84 and of the experiment drivers. A Profiler passed as profiler=...
+# records the time and the number of calls of each stage:
+#   rng                 drawing bits and bases
+#   sampling            numpy backend, sampling of all the outcomes
+#   circuit             building (or fetching from the cache) the circuits of the Qiskit backends
+#   sim_run             simulator runs
+#   get_counts          parsing the measurement outcomes
+#   post_processing     sifting, disclosure and mismatch ratios
+#   reconciliation      Cascade and key verification (BB84_Distillation)
+#   privacy_amplification   Toeplitz hashing to the final key (BB84_Distillation)
+# The same Profiler can be passed to many calls to aggregate a whole sweep. Without a profiler the hooks only
+# cost a comparison with None, every stage goes through the same shared no-op context.
+
+NO_STAGE = nullcontext()
+
+
+def stage(profiler, name):
+    if profiler is None:
+        return NO_STAGE
+    return profiler.stage(name)
+
+
+class Profiler:
+    def __init__(self, trace=False):
+        # with trace=True every stage call is also kept as an event for to_chrome_trace
+        self.trace = trace
+        self.totals = {}
+        self.calls = {}
+        self.events = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name, start, end):
+        self.totals[name] = self.totals.get(name, 0.0) + (end - start)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.trace:
+            self.events.append((name, start, end - start, os.getpid(), threading.get_ident()))
+
+    def merge(self, other):
+        # adds the measurements of another profiler, e.g. one filled in a worker process
+        for name, total in other.totals.items():
+            self.totals[name] = self.totals.get(name, 0.0) + total
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+        if self.trace:
+            self.events.extend(other.events)
+
+    def summary(self):
+        # one row per stage, sorted by total time
+        import pandas as pd
+
+        total = sum(self.totals.values())
+        rows = [{
+            "stage": name,
+            "calls": self.calls[name],
+            "total_s": self.totals[name],
+            "mean_s": self.totals[name] / self.calls[name],
+            "share": self.totals[name] / total if total > 0 else 0.0
+        } for name in self.totals]
+        return pd.DataFrame(rows, columns=["stage", "calls", "total_s", "mean_s", "share"]).sort_values(
+            "total_s", ascending=False, ignore_index=True)
+
+    def to_chrome_trace(self, path):
+        # complete events ("ph": "X") in microseconds, readable by chrome://tracing and Perfetto
+        events = [{
+            "name": name,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": duration * 1e6,
+            "pid": pid,
+            "tid": tid
+        } for name, start, duration, pid, tid in self.events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -1,41 +1,42 @@
-import random
-from time import sleep
+from functools import lru_cache
 
 import numpy as np
-from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit, transpile
-from qiskit.quantum_info import Kraus
-from qiskit_aer import AerSimulator
-from qiskit_aer.noise import pauli_error, NoiseModel
 
+from BB84_Channels import InterceptResend, NOT_INTERCEPTED, flag_channel, sample_plugin_transmissions
+from BB84_PostProcessing import sift_and_estimate
+from BB84_Profiling import stage
+from BB84_Sampling import party_generators, random_bits, random_bases, sample_transmissions
 
-def simulate_bb84(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, seed_gen, verbose=False, save_figure=False):
-    # initializing the random bit generator, qiskit random bit generator is initialized for each simulation
-    random.seed(seed_gen)
-    np.random.seed(seed_gen)
+# Qiskit and Aer are only imported by the functions building and running circuits, so the "numpy" backend and
+# everything importing this module for the classical parts (drivers, post-processing, worker processes) do not pay
+# their import time and memory
 
-    # alice's data structures
-    alice_bits = [random.randint(0, 1) for _ in range(L_init)]
-    alice_basis = [np.random.choice(["Z", "X"]) for _ in range(L_init)]
-    alice_basis = [str(x) for x in alice_basis]
-    alice_quantum_key = []
+# execution paths available for the quantum part of the protocol:
+#   "qiskit"    one circuit and one simulator run for each transmitted bit (reference implementation)
+#   "batched"   batch_size transmissions packed side by side in one wide circuit, one simulator run per batch
+#   "aggregated" bits grouped by circuit shape, one simulator run with many shots for each of the 16 shapes
+#   "numpy"     exact vectorized sampling of all the transmissions without Qiskit, see BB84_Sampling
+BACKENDS = ("qiskit", "batched", "aggregated", "numpy")
+# backends able to run the channel and attack plugins of BB84_Channels
+PLUGIN_BACKENDS = ("aggregated", "numpy")
 
-    # eve's data structures
-    eve_bits = []
-    eve_basis = [np.random.choice(["Z", "X"]) for _ in range(L_init)]
-    eve_basis = [str(x) for x in eve_basis]
+# noise models and simulators are reused across bits and runs, one for each (noise operator, p),
+# the least recently used ones are dropped during long sweeps over p
+NOISE_MODEL_CACHE_SIZE = 32
+# circuits of the plugins, there are 32 shapes for each (channel, attack) pair
+PLUGIN_TEMPLATE_CACHE_SIZE = 1024
 
-    # bob's data structures
-    bob_bits = []
-    bob_basis = [np.random.choice(["Z", "X"]) for _ in range(L_init)]
-    bob_basis = [str(x) for x in bob_basis]
-    bob_quantum_key = []
 
+@lru_cache(maxsize=NOISE_MODEL_CACHE_SIZE)
+def build_noise_model(bit_flip_event, phase_flip_event, p):
     # the quantum channel will be represented by a noise model (it will become a gate)
     # that will apply A with probability p and I with probability (1 - p),
     # with A that depends on the scenario:
     # A = X     bit flip channel
     # A = Z     phase flip channel
     # A = Y     bit-phase flip channel
+    from qiskit_aer.noise import NoiseModel, pauli_error
+
     operator = "I"
     if bit_flip_event and phase_flip_event:
         operator = "Y"
@@ -49,174 +50,385 @@ def simulate_bb84(L_init, eavesdropping_event, bit_flip_event, phase_flip_event,
     ])
     noise_model = NoiseModel()
     noise_model.add_all_qubit_quantum_error(channel_error, ['id'])
+    return noise_model
 
-    # ----- SIMULATION START -----
+
+@lru_cache(maxsize=NOISE_MODEL_CACHE_SIZE)
+def get_simulator(bit_flip_event, phase_flip_event, p, method="automatic"):
+    # the seed is given to each run, so the same simulator can be shared by all the runs with the same channel
+    from qiskit_aer import AerSimulator
+
+    if bit_flip_event or phase_flip_event:
+        return AerSimulator(method=method, noise_model=build_noise_model(bit_flip_event, phase_flip_event, p))
+    return AerSimulator(method=method)
+
+
+def append_bit_transmission(channel_circuit, channel, eavesdropper_channel, eve_measurement, bob_measurement,
+                            alice_bit, alice_x, eve_x, bob_x, eavesdropping_event, noisy_channel):
+    # appends to channel_circuit the transmission of a single bit, channel and eavesdropper_channel are the qubits
+    # used for this transmission, eve_measurement and bob_measurement the classical bits holding the outcomes.
+    # alice_x, eve_x and bob_x are True when the corresponding party uses the X basis
+
+    # resetting initial states to |0⟩
+    channel_circuit.reset(channel)
+    channel_circuit.reset(eavesdropper_channel)
+
+    # alice prepares the qubit, if the bit to send is 1, apply the X gate to get |1⟩,
+    # if the chosen basis is X, convert the state using the H gate
+    if alice_bit == 1:
+        channel_circuit.x(channel)
+    if alice_x:
+        channel_circuit.h(channel)
+    channel_circuit.barrier(channel)
+
+    # eve intercepts the qubit and measures it, if the chosen basis is X, then a H gate is
+    # applied to perform the X basis measurement
+    # (procedure to follow if we want to measure in a different basis using a computational basis measurement device).
+    # After measurement, Eve will reinitialize the qubit in the other channel (initially at |0⟩) by using a controlled X gate,
+    # controlled by the classical bit that contains the measurement result (eventually converted by a H gate)
+    if eavesdropping_event:
+        if eve_x:
+            channel_circuit.h(channel)
+        channel_circuit.measure(channel, eve_measurement)
+        # resend qubit
+        with channel_circuit.if_test((eve_measurement, 1)):
+            channel_circuit.x(eavesdropper_channel)
+        if eve_x:
+            channel_circuit.h(eavesdropper_channel)
+
+    # applying noise to the currently active channel by applying the id gate
+    if eavesdropping_event and noisy_channel:
+        channel_circuit.id(eavesdropper_channel)
+    elif noisy_channel:
+        channel_circuit.id(channel)
+
+    # bob's measurement (same procedure that Eve did)
+    if eavesdropping_event:
+        if bob_x:
+            channel_circuit.h(eavesdropper_channel)
+        channel_circuit.measure(eavesdropper_channel, bob_measurement)
+    else:
+        if bob_x:
+            channel_circuit.h(channel)
+        channel_circuit.measure(channel, bob_measurement)
+
+
+@lru_cache(maxsize=None)
+def transmission_template(alice_bit, alice_x, eve_x, bob_x, eavesdropping_event, noisy_channel):
+    # the single bit circuit only depends on these choices, so there are at most 16 different circuits for
+    # each scenario and they are built once and reused for every bit.
+    # They only contain instructions that Aer executes natively, so the circuit is already in its executable
+    # form, transpiling it to the simulator target would only rewrite X and H into rz/sx rotations
+
+    from qiskit import ClassicalRegister, QuantumCircuit, QuantumRegister
+
+    # quantum channel where Alice sends the qubit, if there is eavesdropping it will be connected to Eve,
+    # otherwise it will be connected to Bob
+    channel = QuantumRegister(1, "channel")
+
+    # channel that connects Eve to Bob, used only for the eavesdropping event. In this channel Eve will
+    # reinitialize the measured qubit to send it to Bob
+    eavesdropper_channel = QuantumRegister(1, "eavesdropper_channel")
+
+    # holding the measurements results
+    eve_measurement = ClassicalRegister(1, "eve_measurement")
+    bob_measurement = ClassicalRegister(1, "bob_measurement")
+
+    channel_circuit = QuantumCircuit(channel, eavesdropper_channel, eve_measurement, bob_measurement)
+    append_bit_transmission(channel_circuit, channel[0], eavesdropper_channel[0], eve_measurement[0],
+                            bob_measurement[0], alice_bit, alice_x, eve_x, bob_x, eavesdropping_event, noisy_channel)
+    return channel_circuit
+
+
+@lru_cache(maxsize=PLUGIN_TEMPLATE_CACHE_SIZE)
+def plugin_template(alice_bit, alice_x, setting, bob_x, channel, attack):
+    # single bit circuit of the plugins, same registers as transmission_template: alice prepares her qubit, the
+    # attack fragment measures it with the setting drawn for it and resends it, the channel fragment acts on the
+    # qubit that reaches bob
+    from qiskit import ClassicalRegister, QuantumCircuit, QuantumRegister
+
+    channel_register = QuantumRegister(1, "channel")
+    eavesdropper_channel = QuantumRegister(1, "eavesdropper_channel")
+    eve_measurement = ClassicalRegister(1, "eve_measurement")
+    bob_measurement = ClassicalRegister(1, "bob_measurement")
+    channel_circuit = QuantumCircuit(channel_register, eavesdropper_channel, eve_measurement, bob_measurement)
+
+    if alice_bit == 1:
+        channel_circuit.x(channel_register[0])
+    if alice_x:
+        channel_circuit.h(channel_register[0])
+    channel_circuit.barrier(channel_register[0])
+
+    qubit = channel_register[0]
+    if attack is not None:
+        qubit = attack.append(channel_circuit, channel_register[0], eavesdropper_channel[0], eve_measurement[0],
+                              setting)
+    if channel is not None:
+        channel.append(channel_circuit, qubit)
+
+    if bob_x:
+        channel_circuit.h(qubit)
+    channel_circuit.measure(qubit, bob_measurement[0])
+    return channel_circuit
+
+
+def run_per_bit(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event, noisy_channel, sim, seed_gen,
+                save_figure=False, profiler=None):
     # starting simulations for each bit to send
-    for i in range(L_init):
-        # quantum channel where Alice sends the qubit, if there is eavesdropping it will be connected to Eve,
-        # otherwise it will be connected to Bob
-        channel = QuantumRegister(1, "channel")
-
-        # channel that connects Eve to Bob, used only for the eavesdropping event. In this channel Eve will
-        # reinitialize the measured qubit to send it to Bob
-        eavesdropper_channel = QuantumRegister(1, "eavesdropper_channel")
-
-        # holding the measurements results
-        eve_measurement = ClassicalRegister(1, "eve_measurement")
-        bob_measurement = ClassicalRegister(1, "bob_measurement")
-
-        # initializing the simulator and quantum circuit
-        sim = None
-        if bit_flip_event or phase_flip_event:
-            sim = AerSimulator(noise_model=noise_model, seed_simulator=seed_gen)
-        else:
-            sim = AerSimulator(seed_simulator=seed_gen)
-        channel_circuit = QuantumCircuit(channel, eavesdropper_channel, eve_measurement, bob_measurement)
-
-        # resetting initial states to |0⟩
-        channel_circuit.reset(channel[0])
-        channel_circuit.reset(eavesdropper_channel[0])
-
-        # alice prepares the qubit, if the bit to send is 1, apply the X gate to get |1⟩,
-        # if the chosen basis is X, convert the state using the H gate
-        if alice_bits[i] == 1:
-            channel_circuit.x(channel[0])
-        if alice_basis[i] == "X":
-            channel_circuit.h(channel[0])
-        channel_circuit.barrier(channel[0])
-
-        # eve intercepts the qubit and measures it, if the chosen basis is X, then a H gate is
-        # applied to perform the X basis measurement
-        # (procedure to follow if we want to measure in a different basis using a computational basis measurement device).
-        # After measurement, Eve will reinitialize the qubit in the other channel (initially at |0⟩) by using a controlled X gate,
-        # controlled by the classical bit that contains the measurement result (eventually converted by a H gate)
-        if eavesdropping_event:
-            if eve_basis[i] == "X":
-                channel_circuit.h(channel[0])
-            channel_circuit.measure(channel[0], eve_measurement[0])
-            # resend qubit
-            with channel_circuit.if_test((eve_measurement[0], 1)):
-                channel_circuit.x(eavesdropper_channel[0])
-            if eve_basis[i] == "X":
-                channel_circuit.h(eavesdropper_channel[0])
-
-        # applying noise to the currently active channel by applying the id gate
-        if eavesdropping_event and (bit_flip_event or phase_flip_event):
-            channel_circuit.id(eavesdropper_channel[0])
-        elif bit_flip_event or phase_flip_event:
-            channel_circuit.id(channel[0])
-
-        # bob's measurement (same procedure that Eve did)
-        if eavesdropping_event:
-            if bob_basis[i] == "X":
-                channel_circuit.h(eavesdropper_channel[0])
-            channel_circuit.measure(eavesdropper_channel[0], bob_measurement[0])
-        else:
-            if bob_basis[i] == "X":
-                channel_circuit.h(channel[0])
-            channel_circuit.measure(channel[0], bob_measurement[0])
+    eve_bits = []
+    bob_bits = []
+    for i in range(len(alice_bits)):
+        with stage(profiler, "circuit"):
+            channel_circuit = transmission_template(int(alice_bits[i]), bool(alice_basis[i]), bool(eve_basis[i]),
+                                                    bool(bob_basis[i]), eavesdropping_event, noisy_channel)
 
         # save the first simulation's circuit layout
         if i == 0 and save_figure:
             channel_circuit.draw(output='mpl', filename='circuito_bb84.png')
-        result = sim.run(channel_circuit, shots=1).result()
+        with stage(profiler, "sim_run"):
+            result = sim.run(channel_circuit, shots=1, seed_simulator=seed_gen).result()
 
         # extracting measurement outcomes for both Eve and Bob, Qiskit will return a dict with a key for each
         # overall measurement outcome, since we have only one shot for the simulation, we can just get the first key
         # and parse it
         # example of key:
         #   "0 1"   ->  Bob measured 0, Eve measured 1
-        counts = result.get_counts(channel_circuit)
-        measured_bitstring = list(counts.keys())[0]
-        if eavesdropping_event:
-            eve_outcome = int(measured_bitstring[2])
-            bob_outcome = int(measured_bitstring[0])
-            eve_bits.append(eve_outcome)
-            bob_bits.append(bob_outcome)
-        else:
-            bob_outcome = int(measured_bitstring[0])
-            bob_bits.append(bob_outcome)
+        with stage(profiler, "get_counts"):
+            counts = result.get_counts(channel_circuit)
+            measured_bitstring = list(counts.keys())[0]
+            if eavesdropping_event:
+                eve_outcome = int(measured_bitstring[2])
+                bob_outcome = int(measured_bitstring[0])
+                eve_bits.append(eve_outcome)
+                bob_bits.append(bob_outcome)
+            else:
+                bob_outcome = int(measured_bitstring[0])
+                bob_bits.append(bob_outcome)
 
         # change seed for the following simulations
         seed_gen += 1
 
+    return np.array(eve_bits, dtype=np.uint8), np.array(bob_bits, dtype=np.uint8)
+
+
+def run_batched(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event, noisy_channel, sim, seed_gen,
+                batch_size=100, save_figure=False, profiler=None):
+    # packs batch_size independent transmissions in a single circuit, transmission j of the batch uses its own
+    # channel[j] and eavesdropper_channel[j] qubits and its own eve_measurement[j] and bob_measurement[j] bits,
+    # so the qubits never interact and each one behaves exactly like in the per-bit circuit.
+    # The gain over the per-bit path is modest: at L_init = 3000 it is about 4x without eavesdropping but only
+    # about 1.6x with it (3.4 s against 5.5 s, where "aggregated" takes 0.26 s), since the mid-circuit measurements
+    # and conditional gates of eve keep the simulator runs expensive, and about a fifth of the time goes into
+    # building every wide circuit. The batch size barely matters, 10 to 100 bits per batch cost about the same
+    from qiskit import ClassicalRegister, QuantumCircuit, QuantumRegister
+
+    eve_bits = []
+    bob_bits = []
+    L_init = len(alice_bits)
+    for start in range(0, L_init, batch_size):
+        size = min(batch_size, L_init - start)
+        with stage(profiler, "circuit"):
+            channel = QuantumRegister(size, "channel")
+            eavesdropper_channel = QuantumRegister(size, "eavesdropper_channel")
+            eve_measurement = ClassicalRegister(size, "eve_measurement")
+            bob_measurement = ClassicalRegister(size, "bob_measurement")
+            channel_circuit = QuantumCircuit(channel, eavesdropper_channel, eve_measurement, bob_measurement)
+            for j in range(size):
+                i = start + j
+                append_bit_transmission(channel_circuit, channel[j], eavesdropper_channel[j], eve_measurement[j],
+                                        bob_measurement[j], alice_bits[i], alice_basis[i], eve_basis[i],
+                                        bob_basis[i], eavesdropping_event, noisy_channel)
+
+        if start == 0 and save_figure:
+            channel_circuit.draw(output='mpl', filename='circuito_bb84.png')
+        # one seed per batch, advancing by the batch size like the per-bit path does for each bit
+        with stage(profiler, "sim_run"):
+            result = sim.run(channel_circuit, shots=1, seed_simulator=seed_gen + start).result()
+
+        # the key holds one group per register, "bob eve", each group is little endian:
+        # transmission j of the batch is the character at position size - 1 - j
+        with stage(profiler, "get_counts"):
+            counts = result.get_counts(channel_circuit)
+            bob_bitstring, eve_bitstring = list(counts.keys())[0].split(" ")
+            bob_bits.extend(int(b) for b in reversed(bob_bitstring))
+            if eavesdropping_event:
+                eve_bits.extend(int(b) for b in reversed(eve_bitstring))
+
+    return np.array(eve_bits, dtype=np.uint8), np.array(bob_bits, dtype=np.uint8)
+
+
+def run_aggregated(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event, noisy_channel, sim, seed_gen,
+                   rng, save_figure=False, profiler=None):
+    # the transmission of a bit only depends on (alice's bit, alice's basis, eve's basis, bob's basis), and the
+    # runs of the per-bit path are independent, so the outcomes of all the bits sharing the same circuit shape are
+    # independent samples of the same distribution: the same distribution that we get from a single run of that
+    # circuit with one shot for each of those bits.
+    # The shots of a shape are then assigned to its bit positions in an order given by a seeded permutation, so the
+    # result does not depend on the order in which Aer returns the shots.
+    # This is statistically equivalent to the per-bit path (the joint distribution of eve's and bob's bits is the
+    # same) but not bit-identical for a given seed
+    alice_bits = np.asarray(alice_bits, dtype=np.uint8)
+    alice_basis = np.asarray(alice_basis, dtype=bool)
+    eve_basis = np.asarray(eve_basis, dtype=bool)
+    bob_basis = np.asarray(bob_basis, dtype=bool)
+    shape_index = alice_bits * 8 + alice_basis * 4 + eve_basis * 2 + bob_basis * 1
+
+    def template(shape):
+        return transmission_template(shape >> 3, bool(shape & 4), bool(shape & 2), bool(shape & 1),
+                                     eavesdropping_event, noisy_channel)
+
+    eve_bits, bob_bits = run_shape_groups(shape_index, 16, template, sim, seed_gen, rng, save_figure, profiler)
+    if not eavesdropping_event:
+        eve_bits = np.empty(0, dtype=np.uint8)
+    return eve_bits, bob_bits
+
+
+def run_plugins_aggregated(alice_bits, alice_basis, settings, bob_basis, channel, attack, sim, seed_gen, rng,
+                           save_figure=False, profiler=None):
+    # aggregated backend of the plugins, the shape of a bit is (alice's bit, alice's basis, eve's setting,
+    # bob's basis), see run_aggregated
+    alice_bits = np.asarray(alice_bits, dtype=np.uint8)
+    alice_basis = np.asarray(alice_basis, dtype=bool)
+    bob_basis = np.asarray(bob_basis, dtype=bool)
+    shape_index = alice_bits * 16 + alice_basis * 8 + np.asarray(settings) * 2 + bob_basis * 1
+
+    def template(shape):
+        return plugin_template(shape >> 4, bool(shape & 8), (shape >> 1) & 3, bool(shape & 1), channel, attack)
+
+    eve_bits, bob_bits = run_shape_groups(shape_index, 32, template, sim, seed_gen, rng, save_figure, profiler)
+    if attack is None:
+        eve_bits = np.empty(0, dtype=np.uint8)
+    return eve_bits, bob_bits
+
+
+def run_shape_groups(shape_index, n_shapes, template, sim, seed_gen, rng, save_figure=False, profiler=None):
+    # one simulator run for each shape, with one shot for each bit of that shape, template(shape) is its circuit
+    eve_bits = np.zeros(len(shape_index), dtype=np.uint8)
+    bob_bits = np.zeros(len(shape_index), dtype=np.uint8)
+    for shape in range(n_shapes):
+        positions = np.flatnonzero(shape_index == shape)
+        if len(positions) == 0:
+            continue
+        with stage(profiler, "circuit"):
+            channel_circuit = template(shape)
+        if save_figure and positions[0] == 0:
+            channel_circuit.draw(output='mpl', filename='circuito_bb84.png')
+        with stage(profiler, "sim_run"):
+            result = sim.run(channel_circuit, shots=len(positions), memory=True,
+                             seed_simulator=seed_gen + shape).result()
+
+        # each shot is a string like "0 1" (Bob measured 0, Eve measured 1), parsed all at once
+        with stage(profiler, "get_counts"):
+            memory = result.get_memory(channel_circuit)
+            outcomes = np.frombuffer("".join(memory).encode(), dtype=np.uint8).reshape(-1, 3) - ord("0")
+        positions = rng.permutation(positions)
+        bob_bits[positions] = outcomes[:, 0]
+        eve_bits[positions] = outcomes[:, 2]
+    return eve_bits, bob_bits
+
+
+def draw_choices(L_init, generators):
+    # alice's data structures, bits are uint8 arrays and bases boolean masks (True for the X basis)
+    alice_bits = random_bits(generators["alice"], L_init)
+    alice_basis = random_bases(generators["alice"], L_init)
+
+    # eve's data structures
+    eve_basis = random_bases(generators["eve"], L_init)
 
+    # bob's data structures
+    bob_basis = random_bases(generators["bob"], L_init)
+
+    return alice_bits, alice_basis, eve_basis, bob_basis
+
+
+def run_transmissions(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event, bit_flip_event,
+                      phase_flip_event, p, seed_gen, generators, backend="qiskit", batch_size=100, save_figure=False,
+                      profiler=None, channel=None, attack=None):
+    # runs the quantum part of the protocol with the chosen backend and returns eve's and bob's bits,
+    # seed_gen seeds the simulator runs of the Qiskit backends
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend!r}, expected one of {BACKENDS}")
+
+    # channel and attack plugins (BB84_Channels), a missing one is the one described by the flags
+    if channel is not None or attack is not None:
+        if backend not in PLUGIN_BACKENDS:
+            raise ValueError(f"channel and attack plugins need one of the backends {PLUGIN_BACKENDS}")
+        if channel is None:
+            channel = flag_channel(bit_flip_event, phase_flip_event, p)
+        if attack is None and eavesdropping_event:
+            attack = InterceptResend()
+        settings = np.full(len(alice_bits), NOT_INTERCEPTED)
+        if attack is not None:
+            settings = attack.settings(eve_basis, generators["eve"])
+        if backend == "numpy":
+            with stage(profiler, "sampling"):
+                return sample_plugin_transmissions(alice_bits, alice_basis, settings, bob_basis, channel, attack,
+                                                   generators["channel"])
+        return run_plugins_aggregated(alice_bits, alice_basis, settings, bob_basis, channel, attack,
+                                      get_simulator(False, False, 0.0), seed_gen, generators["channel"], save_figure,
+                                      profiler)
+
+    # without channel errors p does not change the simulator, all the runs share the noiseless one
+    noisy_channel = bool(bit_flip_event or phase_flip_event)
+    channel_p = float(p) if noisy_channel else 0.0
+
+    if backend == "numpy":
+        with stage(profiler, "sampling"):
+            return sample_transmissions(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event,
+                                        bit_flip_event, phase_flip_event, p, generators["channel"])
+    elif backend == "aggregated":
+        sim = get_simulator(bool(bit_flip_event), bool(phase_flip_event), channel_p)
+        return run_aggregated(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event, noisy_channel, sim,
+                              seed_gen, generators["channel"], save_figure, profiler)
+    elif backend == "batched":
+        sim = get_simulator(bool(bit_flip_event), bool(phase_flip_event), channel_p, "stabilizer")
+        return run_batched(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event, noisy_channel, sim,
+                           seed_gen, batch_size, save_figure, profiler)
+    sim = get_simulator(bool(bit_flip_event), bool(phase_flip_event), channel_p)
+    return run_per_bit(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event, noisy_channel, sim,
+                       seed_gen, save_figure, profiler)
+
+
+def transmit_bits(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, seed_gen, generators,
+                  backend="qiskit", batch_size=100, save_figure=False, profiler=None, channel=None, attack=None):
+    # draws the parties' choices from generators and runs the quantum part of the protocol with the chosen backend
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend!r}, expected one of {BACKENDS}")
+    with stage(profiler, "rng"):
+        alice_bits, alice_basis, eve_basis, bob_basis = draw_choices(L_init, generators)
+
+    # ----- SIMULATION START -----
+    eve_bits, bob_bits = run_transmissions(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event,
+                                           bit_flip_event, phase_flip_event, p, seed_gen, generators, backend,
+                                           batch_size, save_figure, profiler, channel, attack)
     # ----- SIMULATION END -----
-    if verbose:
-        print("Alice's bits:\t", alice_bits)
-        print("Alice's basis:\t", alice_basis)
-        print("Bob's bits:\t", bob_bits)
-        print("Bob's basis:\t", bob_basis)
-        print("Eve's bits:\t", eve_bits)
-        print("Eve's basis:\t", eve_basis)
-
-    # ----- QUANTUM KEY DERIVATION -----
-    # sift the key by taking only the bits correspondant to the same basis (between Alice and Bob)
-    for i in range(L_init):
-        if alice_basis[i] == bob_basis[i]:
-            alice_quantum_key.append(alice_bits[i])
-            bob_quantum_key.append(bob_bits[i])
-    if verbose:
-        print("Alice's quantum key:\t", alice_quantum_key)
-        print("Bob's quantum key:\t", bob_quantum_key)
-        print("Key length:\t", len(alice_quantum_key))
-
-    # ----- PARTIAL QUANTUM KEY DISCLOSURE FOR EAVESDROPPING DETECTION -----
-    # disclose k * (length of quantum key) bits to check how many bits mismatch
-    n_disclosed_bits = int(len(alice_quantum_key) * k)
-    n_mismatched_key_bits = 0
-    for i in range(n_disclosed_bits):
-        if alice_quantum_key[i] != bob_quantum_key[i]:
-            n_mismatched_key_bits += 1
-    if verbose:
-        print("mismatched disclosed key bits:\t", n_mismatched_key_bits)
-
-    # ----- COMPUTATIONS OF RATIOS -----
-    # counting mismatches
-    global_mismatch_count = 0
-    z_mismatch_count = 0
-    z_total_count = 0
-    x_mismatch_count = 0
-    x_total_count = 0
-    for i in range(L_init):
-        if alice_basis[i] == "Z":
-            z_total_count += 1
-        elif alice_basis[i] == "X":
-            x_total_count += 1
-
-        if alice_bits[i] != bob_bits[i]:
-            global_mismatch_count += 1
-            if alice_basis[i] == "Z":
-                z_mismatch_count += 1
-            elif alice_basis[i] == "X":
-                x_mismatch_count += 1
-
-    global_mismatch_ratio = global_mismatch_count / L_init
-    z_mismatch_ratio = z_mismatch_count / z_total_count
-    x_mismatch_ratio = x_mismatch_count / x_total_count
 
-    if verbose:
-        print("Global mismatch ratio:\t", global_mismatch_ratio)
-        print("Z mismatch ratio:\t", z_mismatch_ratio)
-        print("X mismatch ratio:\t", x_mismatch_ratio)
-        print("Mismatched bits:\t", global_mismatch_count)
-
-    # ----- EAVESDROPPING DETECTION -----
-    # computing threshold by considering the average amount of mismatched bits that we expect by considering
-    # the error probability p. If the threshold is lower than the amount of mismatched disclosed bits, we
-    # conclude that eavesdropping has taken place
-    threshold = 0
-    eve_detected = False
-    if (not bit_flip_event and phase_flip_event) or (bit_flip_event and not phase_flip_event):
-        threshold = int(n_disclosed_bits * (p / 2))
-    elif bit_flip_event and phase_flip_event:
-        threshold = int(n_disclosed_bits * p)
-    if n_mismatched_key_bits > threshold:
-        eve_detected = True
+    return alice_bits, alice_basis, eve_basis, eve_bits, bob_bits, bob_basis
+
+
+def simulate_bb84(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, seed_gen, verbose=False,
+                  save_figure=False, backend="qiskit", batch_size=100, profiler=None, channel=None, attack=None):
+    # profiler is an optional BB84_Profiling.Profiler collecting the time spent in each stage.
+    # channel and attack are optional plugins of BB84_Channels replacing the channel and the eavesdropper of the
+    # flags, the flags and p still define the detection threshold
+
+    # initializing one independent random generator for each party, derived from seed_gen,
+    # qiskit random bit generator is initialized for each simulation
+    generators = party_generators(seed_gen)
+
+    alice_bits, alice_basis, eve_basis, eve_bits, bob_bits, bob_basis = transmit_bits(
+        L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, seed_gen, generators, backend, batch_size,
+        save_figure, profiler, channel, attack)
 
     if verbose:
-        print("Disclosed bits:\t\t", n_disclosed_bits)
-        print("Threshold:\t\t", threshold)
-        print("Eve detected:\t", eve_detected)
+        print("Alice's bits:\t", alice_bits.tolist())
+        print("Alice's basis:\t", np.where(alice_basis, "X", "Z").tolist())
+        print("Bob's bits:\t", bob_bits.tolist())
+        print("Bob's basis:\t", np.where(bob_basis, "X", "Z").tolist())
+        print("Eve's bits:\t", eve_bits.tolist())
+        print("Eve's basis:\t", np.where(eve_basis, "X", "Z").tolist())
 
-    return global_mismatch_ratio, z_mismatch_ratio, x_mismatch_ratio, eve_detected
+    # ----- CLASSICAL POST-PROCESSING -----
+    with stage(profiler, "post_processing"):
+        return sift_and_estimate(alice_bits, alice_basis, bob_bits, bob_basis, k, p, bit_flip_event,
+                                 phase_flip_event, verbose)
@@ -0,0 +1,115 @@
+import numpy as np
+
+from BB84_PostProcessing import as_bits, as_x_mask
+
+# Pure NumPy sampler of the quantum part of the protocol.
+# Every circuit built by simulate_bb84 only contains Clifford gates (X, H), measurements in the Z or X basis,
+# a classically controlled X and a single Pauli channel, so each outcome can be sampled exactly without
+# simulating the state:
+#   - measuring a basis state in its own basis returns the encoded bit
+#   - measuring a basis state in the other basis returns a uniformly random bit
+#   - a Pauli error flips the outcome of a measurement in the same basis the state was prepared in when it
+#     anticommutes with that basis: X and Y flip Z basis states, Z and Y flip X basis states.
+#     A Pauli error on a state measured in the other basis does not change the uniform distribution
+
+# streams of random numbers, each party draws its choices from its own generator so that, for example, changing
+# how Eve's bases are drawn does not change Alice's and Bob's choices. "channel" drives the sampled measurement
+# outcomes and channel errors, "public" the public randomness of key distillation (see BB84_Distillation).
+# New streams are only appended, the children spawned before them do not depend on how many follow
+PARTIES = ("alice", "bob", "eve", "channel", "public")
+
+
+def party_generators(seed_gen, chunk=None):
+    # independent PCG64 generators spawned from a single seed, no global random state is touched.
+    # chunk selects an independent family of generators for each chunk of a streamed run, any chunk can be
+    # regenerated on its own
+    if chunk is None:
+        seed_sequence = np.random.SeedSequence(seed_gen)
+    else:
+        seed_sequence = np.random.SeedSequence(seed_gen, spawn_key=(chunk,))
+    seed_sequences = seed_sequence.spawn(len(PARTIES))
+    return {party: np.random.Generator(np.random.PCG64(seed_sequence))
+            for party, seed_sequence in zip(PARTIES, seed_sequences)}
+
+
+def random_bits(rng, n):
+    return rng.integers(0, 2, size=n, dtype=np.uint8)
+
+
+def random_bases(rng, n):
+    # True for the X basis, False for the Z basis
+    return rng.random(n) < 0.5
+
+
+def measure(prepared_bits, prepared_x, measured_x, rng):
+    # outcome of measuring the prepared basis states in the measurement bases
+    outcome = prepared_bits.copy()
+    other_basis = prepared_x != measured_x
+    outcome[other_basis] = rng.integers(0, 2, size=int(other_basis.sum()), dtype=np.uint8)
+    return outcome
+
+
+def apply_channel(bits, prepared_x, bit_flip_event, phase_flip_event, p, rng):
+    # the channel applies A with probability p, the state stays a basis state of the same basis but the encoded
+    # bit is flipped when A anticommutes with it:
+    # A = X     bit flip channel, flips Z basis states
+    # A = Z     phase flip channel, flips X basis states
+    # A = Y     bit-phase flip channel, flips both
+    if not (bit_flip_event or phase_flip_event):
+        return bits
+    error = rng.random(len(bits)) < p
+    flipped = error & np.where(prepared_x, phase_flip_event, bit_flip_event)
+    return bits ^ flipped.astype(np.uint8)
+
+
+def sample_transmissions(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event, bit_flip_event,
+                         phase_flip_event, p, rng):
+    # samples eve's and bob's outcomes for all the transmitted bits at once, see BB84_PostProcessing for the
+    # accepted bits and bases formats
+    alice_bits = as_bits(alice_bits)
+    alice_x = as_x_mask(alice_basis)
+    bob_x = as_x_mask(bob_basis)
+
+    # state entering the noisy channel, either alice's qubit or the one resent by eve
+    channel_bits = alice_bits
+    channel_x = alice_x
+    eve_bits = np.empty(0, dtype=np.uint8)
+    if eavesdropping_event:
+        eve_x = as_x_mask(eve_basis)
+        eve_bits = measure(alice_bits, alice_x, eve_x, rng)
+        channel_bits = eve_bits
+        channel_x = eve_x
+
+    channel_bits = apply_channel(channel_bits, channel_x, bit_flip_event, phase_flip_event, p, rng)
+    bob_bits = measure(channel_bits, channel_x, bob_x, rng)
+    return eve_bits, bob_bits
+
+
+def sample_error_draws(alice_bits, alice_basis, eve_basis, bob_basis, eavesdropping_event, bit_flip_event,
+                       phase_flip_event, rng):
+    # common random numbers of a sweep over p: the same draws as sample_transmissions, but kept apart from p.
+    # Returns eve's and bob's outcomes without channel errors, the uniform draw deciding the channel error of every
+    # bit and the bits whose outcome at bob an error flips, at any p bob's outcome is
+    #   bob_bits ^ (flippable & (uniform < p))
+    # which is exactly what sample_transmissions returns for that p with the same rng state
+    alice_bits = as_bits(alice_bits)
+    alice_x = as_x_mask(alice_basis)
+    bob_x = as_x_mask(bob_basis)
+
+    channel_bits = alice_bits
+    channel_x = alice_x
+    eve_bits = np.empty(0, dtype=np.uint8)
+    if eavesdropping_event:
+        eve_x = as_x_mask(eve_basis)
+        eve_bits = measure(alice_bits, alice_x, eve_x, rng)
+        channel_bits = eve_bits
+        channel_x = eve_x
+
+    uniform = np.ones(len(alice_bits))
+    flippable = np.zeros(len(alice_bits), dtype=bool)
+    if bit_flip_event or phase_flip_event:
+        uniform = rng.random(len(alice_bits))
+        # a flipped state measured in the other basis still gives a uniformly random outcome
+        flippable = np.where(channel_x, phase_flip_event, bit_flip_event) & (channel_x == bob_x)
+    bob_bits = measure(channel_bits, channel_x, bob_x, rng)
+    return eve_bits, bob_bits, uniform, flippable
@@ -0,0 +1,151 @@
+import json
+import os
+from concurrent.futures import as_completed
+
+from BB84_Utils import (cell_executor, simulate_cell, cell_rows, mismatch_ratio_cells, mismatch_ratio_aggregate,
+                        probability_undetected_cells, probability_undetected_aggregate)
+
+# A scenario is one experiment of BB84_Simulations.py, described by a dict holding the experiment type, the CSV
+# file to write and the arguments of the corresponding BB84_Utils experiment.
+# The scheduler flattens the cells of all the scenarios into a single pool, so scenarios run concurrently, and
+# appends every finished cell to a checkpoint file. A cell is identified by
+# (scenario flags, L_init, p, k, seed, backend), a rerun only computes the cells missing from the checkpoint.
+
+
+def mismatch_ratio_scenario(output, eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_r,
+                            repetition_r):
+    return {
+        "experiment": "mismatch_ratio",
+        "output": output,
+        "eavesdropping_event": eavesdropping_event,
+        "bit_flip_event": bit_flip_event,
+        "phase_flip_event": phase_flip_event,
+        "seed": seed,
+        "L_init": L_init,
+        "p_r": p_r,
+        "repetition_r": repetition_r
+    }
+
+
+def probability_undetected_scenario(output, eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_pu,
+                                    k_r, repetition_r):
+    return {
+        "experiment": "probability_undetected",
+        "output": output,
+        "eavesdropping_event": eavesdropping_event,
+        "bit_flip_event": bit_flip_event,
+        "phase_flip_event": phase_flip_event,
+        "seed": seed,
+        "L_init": L_init,
+        "p_pu": p_pu,
+        "k_r": k_r,
+        "repetition_r": repetition_r
+    }
+
+
+def scenario_cells(scenario, backend):
+    flags = (scenario["eavesdropping_event"], scenario["bit_flip_event"], scenario["phase_flip_event"])
+    if scenario["experiment"] == "mismatch_ratio":
+        return mismatch_ratio_cells(*flags, scenario["seed"], scenario["L_init"], scenario["p_r"],
+                                    scenario["repetition_r"], backend)
+    elif scenario["experiment"] == "probability_undetected":
+        return probability_undetected_cells(*flags, scenario["seed"], scenario["L_init"], scenario["p_pu"],
+                                            scenario["k_r"], scenario["repetition_r"], backend)
+    raise ValueError(f"unknown experiment {scenario['experiment']!r}")
+
+
+def scenario_aggregate(scenario, df_cells):
+    if scenario["experiment"] == "mismatch_ratio":
+        return mismatch_ratio_aggregate(df_cells)
+    return probability_undetected_aggregate(df_cells)
+
+
+def cell_key(cell):
+    # json friendly key of a cell, p and k are rounded to get rid of the np.arange representation noise
+    L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, seed, backend = cell
+    return json.dumps([bool(eavesdropping_event), bool(bit_flip_event), bool(phase_flip_event), int(L_init),
+                       round(float(p), 12), round(float(k), 12), int(seed), backend])
+
+
+def load_checkpoint(checkpoint_path):
+    # results of the cells already computed. A partially written last line (crash while writing) is cut from the
+    # file, so that the next record starts on a new line instead of being appended to it
+    checkpoint = {}
+    if not os.path.exists(checkpoint_path):
+        return checkpoint
+    with open(checkpoint_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+        for line in data[:end].decode(errors="replace").splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            checkpoint[entry["key"]] = tuple(entry["result"])
+    return checkpoint
+
+
+def run_scenarios(scenarios, backend="qiskit", workers=None, checkpoint_path="results/checkpoint.jsonl",
+                  store_path=None):
+    # store_path, if given, is the columnar store (see BB84_Store) where the raw cells and the aggregates of every
+    # finished scenario are appended, next to its CSV. The store is imported only then, and a missing pyarrow is
+    # reported before any cell runs
+    if store_path is not None:
+        from BB84_Store import append_scenario, require_pyarrow
+
+        require_pyarrow()
+    checkpoint = load_checkpoint(checkpoint_path)
+
+    # collecting the cells of every scenario, identical cells shared by several scenarios are computed once
+    plans = []
+    pending = {}
+    waiting = {}  # scenarios waiting for each pending cell
+    for i, scenario in enumerate(scenarios):
+        grid, cells = scenario_cells(scenario, backend)
+        keys = [cell_key(cell) for cell in cells]
+        plans.append([scenario, grid, keys, 0])
+        for key, cell in zip(keys, cells):
+            if key not in checkpoint:
+                pending[key] = cell
+                waiting.setdefault(key, []).append(i)
+                plans[i][3] += 1
+
+    def write_scenario(scenario, grid, keys):
+        df_cells = cell_rows(grid, [checkpoint[key] for key in keys])
+        df = scenario_aggregate(scenario, df_cells)
+        os.makedirs(os.path.dirname(scenario["output"]) or ".", exist_ok=True)
+        df.to_csv(scenario["output"], sep=';', index=False)
+        if store_path is not None:
+            append_scenario(store_path, scenario, backend, df_cells, df)
+        print(f"{scenario['output']} done")
+
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    with open(checkpoint_path, "a") as f:
+        def record(key, result):
+            global_R_miss, Z_R_miss, X_R_miss, eve_detected = result
+            checkpoint[key] = (float(global_R_miss), float(Z_R_miss), float(X_R_miss), bool(eve_detected))
+            f.write(json.dumps({"key": key, "result": list(checkpoint[key])}) + "\n")
+            f.flush()
+
+            # writing the CSV of every scenario that was waiting only for this cell
+            for i in waiting.pop(key, []):
+                plans[i][3] -= 1
+                if plans[i][3] == 0:
+                    write_scenario(*plans[i][:3])
+
+        print(f"{len(pending)} cells to compute, {len(checkpoint)} found in {checkpoint_path}")
+        for scenario, grid, keys, missing in plans:
+            if missing == 0:
+                write_scenario(scenario, grid, keys)
+
+        executor = cell_executor(workers)
+        if executor is None:
+            for key, cell in pending.items():
+                record(key, simulate_cell(cell))
+        else:
+            with executor:
+                futures = {executor.submit(simulate_cell, cell): key for key, cell in pending.items()}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
@@ -0,0 +1,89 @@
+import uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # the store is optional, everything else works without pyarrow
+    pa = None
+    ds = None
+
+# Columnar store of the experiment results, a directory of Parquet files partitioned by the scenario flags and
+# L_init (hive layout, e.g. cells/eavesdropping_event=true/bit_flip_event=false/phase_flip_event=false/L_init=300/).
+# It holds one table for the raw rows of every cell and one table of aggregates for each experiment:
+#   <store>/cells/                           p, k, repetition, seed, ratios and undetected flag of every cell
+#   <store>/mismatch_ratio/                  output of BB84_Utils.mismatch_ratio_aggregate
+#   <store>/probability_undetected/          output of BB84_Utils.probability_undetected_aggregate
+# Every write adds new files to the partitions, so the store only grows by appending. Rows written twice
+# (for example by rerunning a scenario) are returned once by read_cells and read_aggregates.
+# Since the raw rows are kept, the aggregates can be recomputed (different alpha, other intervals) from
+# read_cells without running the simulations again.
+
+CELL_KEY_COLUMNS = ["experiment", "eavesdropping_event", "bit_flip_event", "phase_flip_event", "L_init", "p", "k",
+                    "seed", "backend"]
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("the results store needs pyarrow, install it with 'pip install pyarrow'")
+
+
+def partitioning():
+    require_pyarrow()
+    return ds.partitioning(pa.schema([
+        ("eavesdropping_event", pa.bool_()),
+        ("bit_flip_event", pa.bool_()),
+        ("phase_flip_event", pa.bool_()),
+        ("L_init", pa.int64())
+    ]), flavor="hive")
+
+
+def append_table(store_path, table_name, df):
+    part = partitioning()
+    df = df.copy()
+    # p and k come from np.arange, rounding them makes the filters of the reads match the intended values
+    for column in ["p", "k"]:
+        if column in df.columns:
+            df[column] = df[column].astype(float).round(12)
+    ds.write_dataset(pa.Table.from_pandas(df, preserve_index=False), f"{store_path}/{table_name}", format="parquet",
+                     partitioning=part, existing_data_behavior="overwrite_or_ignore",
+                     basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet")
+
+
+def append_scenario(store_path, scenario, backend, df_cells, df_mean):
+    # df_cells are the raw rows of BB84_Utils.cell_rows, df_mean the aggregates written to the scenario CSV
+    columns = {
+        "experiment": scenario["experiment"],
+        "eavesdropping_event": bool(scenario["eavesdropping_event"]),
+        "bit_flip_event": bool(scenario["bit_flip_event"]),
+        "phase_flip_event": bool(scenario["phase_flip_event"]),
+        "L_init": int(scenario["L_init"]),
+        "backend": backend
+    }
+    append_table(store_path, "cells", df_cells.assign(**columns))
+    append_table(store_path, scenario["experiment"], df_mean.assign(**columns))
+
+
+def read_table(store_path, table_name, **filters):
+    # filters are column=value pairs, e.g. p=0.2, L_init=300, eavesdropping_event=True,
+    # a list of values selects any of them
+    dataset = ds.dataset(f"{store_path}/{table_name}", format="parquet", partitioning=partitioning())
+    expression = None
+    for column, value in filters.items():
+        if value is None:
+            continue
+        values = value if isinstance(value, (list, tuple)) else [value]
+        if column in ["p", "k"]:
+            values = [round(float(v), 12) for v in values]
+        condition = ds.field(column).isin(values)
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(filter=expression).to_pandas()
+
+
+def read_cells(store_path, **filters):
+    df = read_table(store_path, "cells", **filters)
+    return df.drop_duplicates(subset=CELL_KEY_COLUMNS, keep="last").reset_index(drop=True)
+
+
+def read_aggregates(store_path, experiment, **filters):
+    return read_table(store_path, experiment, **filters).drop_duplicates().reset_index(drop=True)
+
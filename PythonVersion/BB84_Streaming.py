@@ -0,0 +1,91 @@
+from bisect import bisect_right
+
+import numpy as np
+
+from BB84_PostProcessing import count_mismatches, detection_threshold, mismatch_ratios, sift
+from BB84_Profiling import stage
+from BB84_Protocol_v2 import transmit_bits
+from BB84_Sampling import party_generators
+
+# Streaming version of simulate_bb84 for very large L_init: the bits are transmitted in chunks of chunk_size bits
+# and only running counters are kept, so memory stays O(chunk_size) however many bits are transmitted.
+# Chunk c draws its choices from party_generators(seed_gen, c) and seeds its simulator runs from
+# seed_gen + (first bit of the chunk), so any chunk can be regenerated on its own. For this reason the results
+# depend on chunk_size and are not the same as simulate_bb84 with the same seed, only statistically equivalent.
+DEFAULT_CHUNK_SIZE = 10 ** 6
+
+
+def transmit_chunk(chunk, L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, seed_gen, chunk_size,
+                   backend, batch_size, profiler=None):
+    start = chunk * chunk_size
+    size = min(chunk_size, L_init - start)
+    return transmit_bits(size, eavesdropping_event, bit_flip_event, phase_flip_event, p, seed_gen + start,
+                         party_generators(seed_gen, chunk), backend, batch_size, profiler=profiler)
+
+
+def stream_bb84(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, seed_gen,
+                chunk_size=DEFAULT_CHUNK_SIZE, backend="numpy", batch_size=100, profiler=None):
+    # generator yielding the running counters (see BB84_PostProcessing.count_mismatches) after every chunk,
+    # together with the number of chunks processed so far
+    totals = None
+    n_chunks = -(-L_init // chunk_size)
+    for chunk in range(n_chunks):
+        alice_bits, alice_basis, eve_basis, eve_bits, bob_bits, bob_basis = transmit_chunk(
+            chunk, L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, seed_gen, chunk_size, backend,
+            batch_size, profiler)
+        with stage(profiler, "post_processing"):
+            counts = count_mismatches(alice_bits, alice_basis, bob_bits, bob_basis)
+        if totals is None:
+            totals = counts
+        else:
+            totals = {name: totals[name] + counts[name] for name in counts}
+        totals["chunks"] = chunk + 1
+        yield dict(totals)
+
+
+def simulate_bb84_streaming(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, seed_gen,
+                            chunk_size=DEFAULT_CHUNK_SIZE, backend="numpy", batch_size=100, verbose=False,
+                            profiler=None):
+    # same results as simulate_bb84, (global, Z, X mismatch ratio, eve detected)
+
+    # sifted key length and sifted mismatches at the start of every chunk, the disclosed prefix of the key is
+    # located from these boundaries once the total sifted length is known
+    boundaries_sifted = [0]
+    boundaries_mismatch = [0]
+    totals = None
+    for totals in stream_bb84(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, seed_gen, chunk_size,
+                              backend, batch_size, profiler):
+        boundaries_sifted.append(totals["sifted"])
+        boundaries_mismatch.append(totals["sifted_mismatch"])
+        if verbose:
+            print(f"chunk {totals['chunks']}:\t", totals)
+
+    # ----- PARTIAL QUANTUM KEY DISCLOSURE FOR EAVESDROPPING DETECTION -----
+    # disclose k * (length of quantum key) bits to check how many bits mismatch, the mismatches of the chunks
+    # entirely inside the disclosed prefix are already counted, the chunk where the prefix ends is regenerated
+    n_disclosed_bits = int(totals["sifted"] * k)
+    chunk = bisect_right(boundaries_sifted, n_disclosed_bits) - 1
+    n_mismatched_key_bits = boundaries_mismatch[chunk]
+    remaining = n_disclosed_bits - boundaries_sifted[chunk]
+    if remaining > 0:
+        alice_bits, alice_basis, eve_basis, eve_bits, bob_bits, bob_basis = transmit_chunk(
+            chunk, L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, seed_gen, chunk_size, backend,
+            batch_size, profiler)
+        alice_quantum_key, bob_quantum_key = sift(alice_bits, alice_basis, bob_bits, bob_basis)
+        n_mismatched_key_bits += int(np.count_nonzero(alice_quantum_key[:remaining] != bob_quantum_key[:remaining]))
+
+    # ----- COMPUTATIONS OF RATIOS -----
+    global_mismatch_ratio, z_mismatch_ratio, x_mismatch_ratio = mismatch_ratios(totals)
+
+    # ----- EAVESDROPPING DETECTION -----
+    threshold = detection_threshold(n_disclosed_bits, bit_flip_event, phase_flip_event, p)
+    eve_detected = n_mismatched_key_bits > threshold
+
+    if verbose:
+        print("Key length:\t", totals["sifted"])
+        print("Disclosed bits:\t\t", n_disclosed_bits)
+        print("mismatched disclosed key bits:\t", n_mismatched_key_bits)
+        print("Threshold:\t\t", threshold)
+        print("Eve detected:\t", eve_detected)
+
+    return global_mismatch_ratio, z_mismatch_ratio, x_mismatch_ratio, eve_detected
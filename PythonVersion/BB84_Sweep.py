@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+from BB84_PostProcessing import as_x_mask, detection_threshold
+from BB84_Protocol_v2 import draw_choices
+from BB84_Sampling import party_generators, sample_error_draws
+from BB84_Utils import mismatch_ratio_summary, probability_undetected_summary
+
+# Sweeps over p (and k) with common random numbers: every repetition draws the bits, the bases and the outcomes
+# once, together with a single uniform number per bit deciding its channel error, and evaluates all the values
+# of p on these draws (see BB84_Sampling.sample_error_draws). Neighbouring values of p then only differ by the
+# bits whose uniform number falls between them, so the curves are smooth and a finer grid costs almost nothing.
+# Repetition j uses the seed seed + j * L_init for every p, at each single p the results are those of
+# simulate_bb84(..., backend="numpy") with that seed. Values of different p are correlated, the confidence
+# intervals of each p on its own are unchanged.
+
+
+def count_below(uniform, p_r):
+    # number of the values in uniform below each p of p_r, the same comparison as the channel of the sampler
+    return np.searchsorted(np.sort(uniform), p_r, side="left")
+
+
+def sweep_draws(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, seed_gen):
+    generators = party_generators(seed_gen)
+    alice_bits, alice_basis, eve_basis, bob_basis = draw_choices(L_init, generators)
+    eve_bits, bob_bits, uniform, flippable = sample_error_draws(alice_bits, alice_basis, eve_basis, bob_basis,
+                                                                eavesdropping_event, bit_flip_event, phase_flip_event,
+                                                                generators["channel"])
+    return alice_bits, as_x_mask(alice_basis), as_x_mask(bob_basis), bob_bits, uniform, flippable
+
+
+def sweep_mismatch_ratios(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p_r, seed_gen):
+    # (global, Z, X) mismatch ratios of one repetition at every p of p_r, shape (len(p_r), 3)
+    alice_bits, alice_x, bob_x, bob_bits, uniform, flippable = sweep_draws(L_init, eavesdropping_event,
+                                                                           bit_flip_event, phase_flip_event, seed_gen)
+    p_r = np.asarray(p_r, dtype=float)
+    mismatch = alice_bits != bob_bits
+
+    def count(subset):
+        # mismatches of the subset at every p: an error turns a matching bit into a mismatch and vice versa
+        return (np.count_nonzero(mismatch & subset)
+                + count_below(uniform[flippable & subset & ~mismatch], p_r)
+                - count_below(uniform[flippable & subset & mismatch], p_r))
+
+    x_total = np.count_nonzero(alice_x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        global_mismatch = count(np.ones(L_init, dtype=bool))
+        x_mismatch = count(alice_x)
+        return np.column_stack([global_mismatch / L_init, (global_mismatch - x_mismatch) / (L_init - x_total),
+                                x_mismatch / x_total])
+
+
+def sweep_undetected(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p_r, k_r, seed_gen):
+    # whether eve goes undetected in one repetition at every (p, k), shape (len(p_r), len(k_r))
+    alice_bits, alice_x, bob_x, bob_bits, uniform, flippable = sweep_draws(L_init, eavesdropping_event,
+                                                                           bit_flip_event, phase_flip_event, seed_gen)
+    same_basis = alice_x == bob_x
+    alice_key = alice_bits[same_basis]
+    bob_key = bob_bits[same_basis]
+    uniform = uniform[same_basis]
+    flippable = flippable[same_basis]
+
+    # mismatches within the first n disclosed bits of the sifted key, for each disclosed length of k_r
+    n_disclosed_bits = [int(len(alice_key) * k) for k in k_r]
+    undetected = np.zeros((len(p_r), len(k_r)), dtype=bool)
+    for i, p in enumerate(p_r):
+        mismatch = alice_key != (bob_key ^ (flippable & (uniform < p)))
+        prefix = np.concatenate([[0], np.cumsum(mismatch)])
+        for j, n in enumerate(n_disclosed_bits):
+            undetected[i, j] = prefix[n] <= detection_threshold(n, bit_flip_event, phase_flip_event, p)
+    return undetected
+
+
+def mismatch_ratio_sweep(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_r, repetition_r,
+                         alpha=0.01):
+    # same output as BB84_Utils.mismatch_ratio_experiment
+    grid = []
+    results = []
+    ratios = [sweep_mismatch_ratios(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p_r,
+                                    seed + j * L_init) for j in range(len(repetition_r))]
+    for i, p in enumerate(p_r):
+        for j, repetition in enumerate(repetition_r):
+            grid.append((p, 0, repetition, seed + j * L_init))
+            results.append((*ratios[j][i], False))
+    return mismatch_ratio_summary(grid, results, alpha)
+
+
+def probability_undetected_sweep(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_pu, k_r,
+                                 repetition_r, alpha=0.01):
+    # same output as BB84_Utils.probability_undetected_experiment, p_pu can also be a range of p, the aggregates
+    # of every p are then concatenated with a column p
+    p_r = np.atleast_1d(p_pu)
+    undetected = [sweep_undetected(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p_r, k_r,
+                                   seed + j * L_init) for j in range(len(repetition_r))]
+    summaries = []
+    for i, p in enumerate(p_r):
+        grid = []
+        results = []
+        for l, k in enumerate(k_r):
+            for j, repetition in enumerate(repetition_r):
+                grid.append((p, k, repetition, seed + j * L_init))
+                results.append((np.nan, np.nan, np.nan, not undetected[j][i, l]))
+        summaries.append(probability_undetected_summary(grid, results, alpha))
+    if np.ndim(p_pu) == 0:
+        return summaries[0]
+    return pd.concat([summary.assign(p=p) for p, summary in zip(p_r, summaries)], ignore_index=True)
@@ -1,40 +1,128 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import pandas as pd
 import numpy as np
+from BB84_Profiling import Profiler
 from BB84_Protocol_v2 import simulate_bb84
-from scipy.stats import norm
 
 
-def mismatch_ratio_experiment(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_r, repetition_r):
+def simulate_cell(cell, profiler=None):
+    # runs a single cell of an experiment grid, cell holds the positional arguments of simulate_bb84
+    # followed by the backend
+    *args, backend = cell
+    return simulate_bb84(*args, backend=backend, profiler=profiler)
+
+
+def simulate_cell_profiled(cell, trace=False):
+    # runs a cell in a worker process with its own profiler, that is sent back to be merged
+    profiler = Profiler(trace)
+    return simulate_cell(cell, profiler), profiler
+
+
+def cell_executor(workers=None):
+    # process pool for map_cells, None runs the cells in this process.
+    # Workers are spawned rather than forked, Aer runs OpenMP threads that can deadlock a forked child
+    if workers is None or workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def map_cells(executor, workers, cells, profiler=None):
+    # runs cells on the executor of cell_executor(workers) (in this process if it is None), results in the same order
+    if executor is None:
+        return [simulate_cell(cell, profiler) for cell in cells]
+    chunksize = max(1, len(cells) // (4 * workers))
+    if profiler is None:
+        return list(executor.map(simulate_cell, cells, chunksize=chunksize))
+    results = []
+    for result, cell_profiler in executor.map(partial(simulate_cell_profiled, trace=profiler.trace), cells,
+                                              chunksize=chunksize):
+        profiler.merge(cell_profiler)
+        results.append(result)
+    return results
+
+
+def run_cells(cells, workers=None, profiler=None):
+    # runs all the cells of an experiment grid and returns their results in the same order as cells.
+    # Every cell carries its own precomputed seed, so fanning them out over a process pool gives exactly
+    # the same results as running them one after the other.
+    executor = cell_executor(workers)
+    if executor is None:
+        return map_cells(None, workers, cells, profiler)
+    with executor:
+        return map_cells(executor, workers, cells, profiler)
+
+
+def cell_rows(grid, results):
+    # raw results of every cell of an experiment grid, one row for each (p, k, repetition)
     # save intermediate results
     df = pd.DataFrame(columns=[
         "p",
+        "k",
         "repetition",
         "seed",
         "global_R_miss",
         "Z_R_miss",
-        "X_R_miss"
+        "X_R_miss",
+        "undetected"
     ])
     rows = []
 
-    # starting experiments
+    for (p, k, repetition, cell_seed), (global_R_miss, Z_R_miss, X_R_miss, eve_detected) in zip(grid, results):
+        # safe data from simulation in Dataframe
+        rows.append({
+            "p": p,
+            "k": k,
+            "repetition": repetition,
+            "seed": cell_seed,
+            "global_R_miss": global_R_miss,
+            "Z_R_miss": Z_R_miss,
+            "X_R_miss": X_R_miss,
+            "undetected": int(not eve_detected)
+        })
+
+    df = pd.DataFrame(rows, columns=df.columns)
+    return df
+
+
+def confidence_half_width(std, n, alpha=0.01):
+    # half-width of the normal (1 - alpha) confidence interval of the mean of n values with standard deviation std.
+    # scipy.stats is imported here, it takes longer to import than everything else the workers need
+    from scipy.stats import norm
+
+    z = norm.ppf(1 - alpha / 2)
+    sem = std / np.sqrt(n)
+    return z * sem
+
+
+def welford_update(state, values):
+    # Welford's streaming update of (count, mean, sum of squared deviations from the mean) with one more value of
+    # each of the tracked quantities, the variance is m2 / (count - 1)
+    count, mean, m2 = state
+    count += 1
+    delta = values - mean
+    mean = mean + delta / count
+    m2 = m2 + delta * (values - mean)
+    return count, mean, m2
+
+
+def mismatch_ratio_cells(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_r, repetition_r,
+                         backend="qiskit"):
+    # building the grid, loop over all possible combinations of p and repetition times
+    grid = []
     for p in p_r:
-        for repetition in repetition_r:  # loop over all possible combinations of p and repetition times
-            global_R_miss, Z_R_miss, X_R_miss, eve_detected = simulate_bb84(L_init, eavesdropping_event, bit_flip_event,
-                                                                            phase_flip_event, p, 0, seed)
-
-            # safe data from simulation in Dataframe
-            rows.append({
-                "p": p,
-                "repetition": repetition,
-                "seed": seed,
-                "global_R_miss": global_R_miss,
-                "Z_R_miss": Z_R_miss,
-                "X_R_miss": X_R_miss
-            })
+        for repetition in repetition_r:
+            grid.append((p, 0, repetition, seed))
             seed += L_init  # change seed for next run
 
-    df = pd.DataFrame(rows)
+    cells = [(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, cell_seed, backend)
+             for p, k, repetition, cell_seed in grid]
+    return grid, cells
 
+
+def mismatch_ratio_aggregate(df, alpha=0.01):
     # compute the mean value of each experiment
     df_mean = df.groupby("p").agg(
         global_R_miss_mean=("global_R_miss", "mean"),
@@ -43,16 +131,14 @@ def mismatch_ratio_experiment(eavesdropping_event, bit_flip_event, phase_flip_ev
     ).reset_index()
 
     # calculate the upper and lower value for confidence intervall
-    alpha = 0.01  # set value for alpha -> for 99% CI
-    n = len(repetition_r)
-    z = norm.ppf(1 - alpha / 2)
+    # alpha = 0.01 -> for 99% CI
+    n = df.groupby("p").size().to_numpy()[:, None]  # repetitions of each p
 
     cols = ["global_R_miss", "Z_R_miss", "X_R_miss"]
     df_std = df.groupby("p")[["global_R_miss", "Z_R_miss", "X_R_miss"]].std()
-    sem = df_std[cols].to_numpy() / np.sqrt(n)
 
     # Half-width of 99%-CI
-    hw = z * sem
+    hw = confidence_half_width(df_std[cols].to_numpy(), n, alpha)
 
     # Lower/Upper CI
     df_mean[[c + "_lower" for c in cols]] = -hw
@@ -61,51 +147,115 @@ def mismatch_ratio_experiment(eavesdropping_event, bit_flip_event, phase_flip_ev
     return df_mean
 
 
-def probability_undetected_experiment(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_pu, k_r,
-                                      repetition_r):
-    # save intermediate results
-    df = pd.DataFrame(columns=[
-        "p",
-        "k",
-        "repetition",
-        "seed",
-        "undetected"
-    ])
+def mismatch_ratio_summary(grid, results, alpha=0.01):
+    return mismatch_ratio_aggregate(cell_rows(grid, results), alpha)
+
+
+def mismatch_ratio_adaptive(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_r, repetition_r,
+                            target_half_width, min_repetitions=10, backend="qiskit", workers=None, profiler=None,
+                            alpha=0.01):
+    # sequential version of mismatch_ratio_experiment: the repetitions of every p run in rounds of min_repetitions
+    # until the half-widths of the confidence intervals of the three ratios are all below target_half_width, or
+    # all of repetition_r has run. Only the running mean and variance of every p are kept (Welford), not the rows.
+    # Repetition j of the i-th p uses the seed it has in mismatch_ratio_cells, so a p that runs to the cap gives
+    # the same values as the fixed grid.
+    if min_repetitions < 1:
+        raise ValueError("min_repetitions must be at least 1")
+    if not target_half_width > 0:
+        raise ValueError("target_half_width must be positive")
+    n_repetitions = len(repetition_r)
+    states = [(0, np.zeros(3), np.zeros(3)) for _ in p_r]
+    remaining = list(range(len(p_r)))
+
+    executor = cell_executor(workers)
+    try:
+        while remaining:
+            cells = []
+            owners = []
+            for i in remaining:
+                first = states[i][0]
+                for j in range(first, min(first + min_repetitions, n_repetitions)):
+                    cell_seed = seed + (i * n_repetitions + j) * L_init
+                    cells.append((L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p_r[i], 0, cell_seed,
+                                  backend))
+                    owners.append(i)
+
+            for i, (global_R_miss, Z_R_miss, X_R_miss, eve_detected) in zip(owners, map_cells(executor, workers, cells,
+                                                                                              profiler)):
+                states[i] = welford_update(states[i], np.array([global_R_miss, Z_R_miss, X_R_miss]))
+
+            still_wide = []
+            for i in remaining:
+                count, mean, m2 = states[i]
+                if count >= n_repetitions:
+                    continue
+                hw = confidence_half_width(np.sqrt(m2 / (count - 1)), count, alpha) if count > 1 else np.inf
+                if not np.all(hw <= target_half_width):
+                    still_wide.append(i)
+            remaining = still_wide
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     rows = []
+    cols = ["global_R_miss", "Z_R_miss", "X_R_miss"]
+    for p, (count, mean, m2) in zip(p_r, states):
+        std = np.sqrt(m2 / (count - 1)) if count > 1 else np.full(3, np.nan)
+        hw = confidence_half_width(std, count, alpha)
+        row = {"p": p}
+        row.update({c + "_mean": m for c, m in zip(cols, mean)})
+        row.update({c + "_lower": -h for c, h in zip(cols, hw)})
+        row.update({c + "_upper": h for c, h in zip(cols, hw)})
+        row["repetitions"] = count
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def mismatch_ratio_experiment(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_r, repetition_r,
+                              backend="qiskit", workers=None, profiler=None, target_half_width=None,
+                              min_repetitions=10, alpha=0.01):
+    # with target_half_width, repetition_r is only the cap of an adaptive run, see mismatch_ratio_adaptive
+    if target_half_width is not None:
+        return mismatch_ratio_adaptive(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_r,
+                                       repetition_r, target_half_width, min_repetitions, backend, workers, profiler,
+                                       alpha)
+
+    grid, cells = mismatch_ratio_cells(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_r,
+                                       repetition_r, backend)
 
     # starting experiments
+    results = run_cells(cells, workers, profiler)
+
+    return mismatch_ratio_summary(grid, results, alpha)
+
+
+def probability_undetected_cells(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_pu, k_r,
+                                 repetition_r, backend="qiskit"):
+    # building the grid, loop over all possible combinations of k and repetition times
+    grid = []
     for k in k_r:
-        for repetition in repetition_r:  # loop over all possible combinations of p and repetition times
-            global_R_miss, Z_R_miss, X_R_miss, eve_detected = simulate_bb84(L_init, eavesdropping_event, bit_flip_event,
-                                                                            phase_flip_event, p_pu, k, seed)
-
-            # safe data from simulation in Dataframe
-            rows.append({
-                "p": p_pu,
-                "k": k,
-                "repetition": repetition,
-                "seed": seed,
-                "undetected": int(not eve_detected)
-            })
+        for repetition in repetition_r:
+            grid.append((p_pu, k, repetition, seed))
             seed += L_init  # change seed for next run
 
-    df = pd.DataFrame(rows)
+    cells = [(L_init, eavesdropping_event, bit_flip_event, phase_flip_event, p, k, cell_seed, backend)
+             for p, k, repetition, cell_seed in grid]
+    return grid, cells
 
+
+def probability_undetected_aggregate(df, alpha=0.01):
     # probability by averaging the amount of 0 and 1 in detected column
     df_mean = df.groupby("k").agg(
         undetected_mean=("undetected", "mean")
     ).reset_index()
 
-    alpha = 0.01  # set value for alpha -> for 99% certainty
-    n = len(repetition_r)
-    z = norm.ppf(1 - alpha / 2)
+    # alpha = 0.01 -> for 99% certainty
+    n = df.groupby("k").size().to_numpy()  # repetitions of each k
 
     df_std = df.groupby("k")[["undetected"]].std()
-    sem = df_std["undetected"].to_numpy() / np.sqrt(n)
 
     # Half-width of 99%-CI
-    hw = z * sem
+    hw = confidence_half_width(df_std["undetected"].to_numpy(), n, alpha)
 
     # Lower/Upper CI
     df_mean["undetected_lower"] = -hw
@@ -114,3 +264,24 @@ def probability_undetected_experiment(eavesdropping_event, bit_flip_event, phase
     return df_mean
 
 
+def probability_undetected_summary(grid, results, alpha=0.01):
+    return probability_undetected_aggregate(cell_rows(grid, results), alpha)
+
+
+def probability_undetected_experiment(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init, p_pu, k_r,
+                                      repetition_r, backend="qiskit", workers=None, profiler=None):
+    # backend="analytic" computes the exact probabilities instead of simulating (see BB84_Analytic), with the
+    # prediction interval of the mean of len(repetition_r) simulated repetitions
+    if backend == "analytic":
+        from BB84_Analytic import probability_undetected_analytic
+
+        return probability_undetected_analytic(eavesdropping_event, bit_flip_event, phase_flip_event, L_init, p_pu,
+                                               k_r, len(repetition_r))
+
+    grid, cells = probability_undetected_cells(eavesdropping_event, bit_flip_event, phase_flip_event, seed, L_init,
+                                               p_pu, k_r, repetition_r, backend)
+
+    # starting experiments
+    results = run_cells(cells, workers, profiler)
+
+    return probability_undetected_summary(grid, results)